@@ -1,36 +1,61 @@
 """"The initializer module for the webserver. """
 import os
 import logging
+import multiprocessing
 from flask import Flask
 from app.data_ingestor import DataIngestor
+from app.dataset_reloader import DatasetReloader
+from app.log_pipeline import setup_logging
+from app.result_cache import ResultCache
+from app.shared_store import create_job_stores
 from app.task_runner import ThreadPool
 
-if not os.path.exists('results'):
-    os.mkdir('results')
-
 webserver = Flask(__name__)
-logging.basicConfig(
-    filename='webserver.log',
-    filemode='w',  # Append mode
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s '
-           '(LINE:%(lineno)d) FILE:%(filename)s',
-    datefmt='%Y-%m-%d %H:%M:%S %Z',
-    level=logging.DEBUG
-)
 
 logger = logging.getLogger('webserver')
 
-webserver.tasks_runner = ThreadPool()
-logger.info('Thread pool initialized')
 LOCAL_FILE = "./nutrition_activity_obesity_usa_subset.csv"
 FALLBACK_FILE = "../nutrition_activity_obesity_usa_subset.csv"
 
-if os.path.exists(LOCAL_FILE):
-    webserver.data_ingestor = DataIngestor(LOCAL_FILE)
-else:
-    webserver.data_ingestor = DataIngestor(FALLBACK_FILE)
-logger.info('Data ingestor initialized')
 
-webserver.job_counter = 1
+def swap_data_ingestor(data_ingestor: DataIngestor):
+    """ makes the jobs submitted from now on use a new dataset version; the
+    worker processes only hold versions loaded from the csv, the queries on
+    appended rows run in the task runner threads """
+    if webserver.tasks_runner.process_backend is not None and not data_ingestor.appended_rows:
+        webserver.tasks_runner.process_backend.reload(data_ingestor)
+    webserver.data_ingestor = data_ingestor
+
+
+def start_webserver():
+    """ loads the dataset and starts the threads of the webserver """
+    if not os.path.exists('results'):
+        os.mkdir('results')
+
+    # records are written to webserver.log by a listener thread
+    webserver.log_listener = setup_logging()
+
+    if os.path.exists(LOCAL_FILE):
+        webserver.data_ingestor = DataIngestor(LOCAL_FILE)
+    else:
+        webserver.data_ingestor = DataIngestor(FALLBACK_FILE)
+    logger.info('Data ingestor initialized')
+
+    webserver.result_cache = ResultCache.from_env()
+    webserver.job_registry, webserver.result_store = create_job_stores()
+    webserver.tasks_runner = ThreadPool(webserver.result_cache, webserver.result_store,
+                                        webserver.data_ingestor, webserver.job_registry)
+    logger.info('Thread pool initialized')
+
+    webserver.dataset_reloader = DatasetReloader(webserver.data_ingestor, swap_data_ingestor)
+    # with DATA_WATCH_INTERVAL=<seconds> the dataset is reloaded when the csv changes
+    if float(os.getenv('DATA_WATCH_INTERVAL', '0')) > 0:
+        webserver.dataset_reloader.watch(float(os.getenv('DATA_WATCH_INTERVAL')))
+
+
+# the worker processes of the process backend import this package to answer
+# the queries, they do not start a webserver of their own
+if multiprocessing.current_process().name == 'MainProcess':
+    start_webserver()
 
 from app import routes
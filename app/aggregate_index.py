@@ -0,0 +1,148 @@
+"""" This module contains the AggregateIndex class which keeps
+  per-question sums and counts of the survey values, so that the
+  endpoints are answered without scanning the whole dataset
+ """
+import pandas as pd
+
+QUESTION_COLUMN = 'Question'
+STATE_COLUMN = 'LocationDesc'
+CATEGORY_COLUMNS = ['LocationDesc', 'StratificationCategory1', 'Stratification1']
+VALUE_COLUMN = 'Data_Value'
+
+
+def add_sums(left: pd.DataFrame, right: pd.DataFrame) -> pd.DataFrame:
+    """ sums and counts of two groupings, aligned on their keys """
+    merged = left.add(right, fill_value=0)
+    merged['count'] = merged['count'].astype('int64')
+    return merged
+
+
+class QuestionAggregates:
+    """ Sums and counts of the values answering a single question """
+
+    def __init__(self, total_sum: float, total_count: int,
+                 by_state: pd.DataFrame, by_category: pd.DataFrame):
+        self.total_sum = total_sum
+        self.total_count = total_count
+        # 'sum' and 'count' columns indexed by state
+        self.by_state = by_state
+        # 'sum' and 'count' columns indexed by (state, category, stratification)
+        self.by_category = by_category
+        # means derived on first use and shared by all the queries of the question
+        self._state_means = None
+        self._category_means = None
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame):
+        """ build the aggregates of the rows of one question """
+        values = df[VALUE_COLUMN]
+        by_state = df.groupby(STATE_COLUMN, observed=True)[VALUE_COLUMN].agg(['sum', 'count'])
+        by_category = df.groupby(CATEGORY_COLUMNS, observed=True)[VALUE_COLUMN].agg(
+            ['sum', 'count'])
+        return cls(values.sum(), values.count(), by_state, by_category)
+
+    @classmethod
+    def empty(cls):
+        """ aggregates of a question without any rows """
+        by_state = pd.DataFrame({'sum': [], 'count': []},
+                                index=pd.Index([], name=STATE_COLUMN))
+        by_category = pd.DataFrame(
+            {'sum': [], 'count': []},
+            index=pd.MultiIndex.from_tuples([], names=CATEGORY_COLUMNS))
+        return cls(0.0, 0, by_state, by_category)
+
+    def merge(self, other: 'QuestionAggregates') -> 'QuestionAggregates':
+        """ aggregates of the rows of both, which are left unchanged """
+        return QuestionAggregates(self.total_sum + other.total_sum,
+                                  self.total_count + other.total_count,
+                                  add_sums(self.by_state, other.by_state),
+                                  add_sums(self.by_category, other.by_category))
+
+    def global_mean(self) -> float:
+        """ mean of all the values of the question """
+        if self.total_count == 0:
+            return float('nan')
+        return self.total_sum / self.total_count
+
+    def state_means(self) -> pd.Series:
+        """ mean value per state, NaN for states without values """
+        if self._state_means is None:
+            self._state_means = self.by_state['sum'] / self.by_state['count']
+        return self._state_means
+
+    def state_mean(self, state: str) -> float:
+        """ mean value of a single state, NaN for anything but a known state """
+        if not isinstance(state, str) or state not in self.by_state.index:
+            return float('nan')
+        state_sum, state_count = self.by_state.loc[state, ['sum', 'count']]
+        if state_count == 0:
+            return float('nan')
+        return state_sum / state_count
+
+    def category_means(self) -> pd.Series:
+        """ mean value per (state, category, stratification) """
+        if self._category_means is None:
+            means = self.by_category['sum'] / self.by_category['count']
+            means.name = VALUE_COLUMN
+            self._category_means = means
+        return self._category_means
+
+    def state_category_means(self, state: str) -> pd.Series:
+        """ mean value per (category, stratification) of a single state,
+        empty for anything but a known state """
+        means = self.category_means()
+        if isinstance(state, str):
+            try:
+                return means.xs(state, level=STATE_COLUMN)
+            except (KeyError, TypeError, pd.errors.InvalidIndexError):
+                pass
+        return means.iloc[0:0].droplevel(STATE_COLUMN)
+
+
+class AggregateIndex:
+    """ Per-question aggregates built once from the whole dataset """
+
+    def __init__(self, questions: dict, version: int = 1):
+        self.questions = questions
+        # dataset version, results computed on another version are stale
+        self.version = version
+        self._empty = QuestionAggregates.empty()
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, version: int = 1):
+        """ build the index of a dataset version from a frame holding the survey rows """
+        if not pd.api.types.is_float_dtype(df[VALUE_COLUMN]):
+            df = df.assign(**{VALUE_COLUMN: pd.to_numeric(df[VALUE_COLUMN], errors='coerce')})
+        questions = {
+            question: QuestionAggregates.from_frame(rows)
+            for question, rows in df.groupby(QUESTION_COLUMN, observed=True, sort=False)
+        }
+        return cls(questions, version)
+
+    @classmethod
+    def from_chunks(cls, chunks, version: int = 1):
+        """ build the index of a dataset version from frames of survey rows
+        read one after the other; only the aggregates are kept between two
+        frames, so the memory used does not grow with the number of rows """
+        index = cls({}, version)
+        for chunk in chunks:
+            index = index.append(chunk)
+        return cls(index.questions, version)
+
+    def append(self, df: pd.DataFrame) -> 'AggregateIndex':
+        """ index of the next version with the rows of `df` added, built in
+        time proportional to the rows; the aggregates of the questions
+        without new rows are shared with this index, which is left unchanged """
+        questions = dict(self.questions)
+        for question, rows in df.groupby(QUESTION_COLUMN, observed=True, sort=False):
+            added = QuestionAggregates.from_frame(rows)
+            current = questions.get(question)
+            questions[question] = current.merge(added) if current is not None else added
+        return AggregateIndex(questions, self.version + 1)
+
+    def get(self, question: str) -> QuestionAggregates:
+        """ the aggregates of a question, empty if the question is unknown """
+        return self.questions.get(question, self._empty)
+
+    def __contains__(self, question: str) -> bool:
+        return question in self.questions
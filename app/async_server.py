@@ -0,0 +1,299 @@
+"""" This module contains the AsyncFrontEnd class, an asyncio HTTP server
+  serving the same /api/* routes as the Flask server, in which waiting
+  clients are held by the event loop instead of by a server thread
+
+    python -m app.async_server
+ """
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import parse_qsl, unquote_to_bytes, urlencode
+
+from app import webserver
+from app.routes import MAX_RESULT_WAIT
+
+RESULTS_PREFIX = '/api/get_results/'
+# upper bound of the size of a request body
+MAX_BODY_BYTES = int(os.getenv('ASYNC_MAX_BODY_BYTES', str(16 * 1024 * 1024)))
+# seconds given to a client to send the head, and then the body, of a request
+READ_TIMEOUT = float(os.getenv('ASYNC_READ_TIMEOUT', '10'))
+# seconds a kept-alive connection may stay idle between two requests
+KEEP_ALIVE_TIMEOUT = float(os.getenv('ASYNC_KEEP_ALIVE_TIMEOUT', '5'))
+
+
+def run_wsgi(app, environ: dict) -> tuple:
+    """ status, headers, first body chunk and body of a WSGI call """
+    started = []
+
+    def start_response(status, headers, _exc_info=None):
+        started[:] = [status, headers]
+
+    body = app(environ, start_response)
+    first = next_chunk(iter(body), body)
+    return started[0], started[1], first, body
+
+
+def next_chunk(chunks, body) -> Optional[bytes]:
+    """ the next non-empty chunk of a WSGI body, None once it is exhausted
+    and closed """
+    for chunk in chunks:
+        if chunk:
+            return chunk
+    if hasattr(body, 'close'):
+        body.close()
+    return None
+
+
+def read_body(app, environ: dict) -> tuple:
+    """ status, headers and whole body of a WSGI call """
+    status, headers, chunk, body = run_wsgi(app, environ)
+    chunks = iter(body)
+    content = []
+    while chunk is not None:
+        content.append(chunk)
+        chunk = next_chunk(chunks, body)
+    return status, headers, b''.join(content)
+
+
+def parse_head(head: bytes) -> tuple:
+    """ method, target, version and headers of a request head; the headers
+    are keyed as in a WSGI environ, without the HTTP_ prefix, and the values of
+    a repeated header are joined by commas; raises ValueError when the head
+    is malformed """
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, version = lines[0].split(' ')
+    if not (method and target and version.startswith('HTTP/')):
+        raise ValueError(lines[0])
+    headers = {}
+    for line in filter(None, lines[1:]):
+        name, value = line.split(':', 1)
+        name = name.strip().upper().replace('-', '_')
+        headers[name] = f'{headers[name]},{value.strip()}' if name in headers \
+            else value.strip()
+    return method, target, version, headers
+
+
+def content_length(value: str) -> int:
+    """ body length given by a Content-Length header; raises ValueError
+    unless it is digits only, e.g. for a sign or the two values of a repeated
+    header """
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError(value)
+    return int(value)
+
+
+def wsgi_environ(head: tuple, body: bytes, writer, peer) -> dict:
+    """ WSGI environ of a request read from a connection, given the method,
+    target, version and headers of its head """
+    method, target, version, headers = head
+    target, _, query = target.partition('?')
+    environ = {
+        'REQUEST_METHOD': method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': unquote_to_bytes(target).decode('latin-1'),
+        'QUERY_STRING': query,
+        'SERVER_NAME': writer.get_extra_info('sockname')[0],
+        'SERVER_PORT': str(writer.get_extra_info('sockname')[1]),
+        'SERVER_PROTOCOL': version,
+        'REMOTE_ADDR': peer[0],
+        'REMOTE_PORT': str(peer[1]),
+        'CONTENT_LENGTH': str(len(body)) if body else '',
+        'CONTENT_TYPE': headers.pop('CONTENT_TYPE', ''),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    environ.update((f'HTTP_{name}', value) for name, value in headers.items())
+    return environ
+
+
+class AsyncFrontEnd:
+    """ Serves a WSGI app over HTTP/1.1 from an asyncio loop; requests are
+    handed to the app on a few threads, and the waits for jobs (`?wait=` of
+    get_results and of the job submissions) are awaited on the loop """
+
+    def __init__(self, app, pool, max_wait: float, threads: int = 16):
+        self.app = app
+        self.pool = pool
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix='async-wsgi')
+        self.logger = logging.getLogger('webserver')
+
+    async def serve(self, host: str, port: int, backlog: int = 1024) -> asyncio.AbstractServer:
+        """ starts listening, returns the server """
+        server = await asyncio.start_server(self.handle, host, port, backlog=backlog)
+        self.logger.info('Async front end listening on %s:%d', host, port)
+        return server
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """ serves the requests of a connection until it is closed """
+        peer = writer.get_extra_info('peername') or ('', 0)
+        try:
+            keep_alive, timeout = True, READ_TIMEOUT
+            while keep_alive:
+                request = await self.read_request(reader, writer, peer, timeout)
+                if request is None:
+                    break
+                environ, keep_alive = request
+                keep_alive = await self.respond(environ, writer, keep_alive)
+                timeout = KEEP_ALIVE_TIMEOUT
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_head(self, reader, writer, timeout: float) -> Optional[tuple]:
+        """ (method, target, version, headers) and body length of the next
+        request, None when there is no valid request to answer """
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError):
+            return None
+        except asyncio.LimitOverrunError:
+            await self.write_error(writer, '431 Request Header Fields Too Large')
+            return None
+        try:
+            method, target, version, headers = parse_head(head)
+            length = content_length(headers.pop('CONTENT_LENGTH', '0'))
+        except ValueError:
+            await self.write_error(writer, '400 Bad Request')
+            return None
+        if 'TRANSFER_ENCODING' in headers:
+            await self.write_error(writer, '411 Length Required')
+            return None
+        if length > MAX_BODY_BYTES:
+            await self.write_error(writer, '413 Content Too Large')
+            return None
+        return (method, target, version, headers), length
+
+    async def read_request(self, reader, writer, peer, timeout: float) -> Optional[tuple]:
+        """ WSGI environ of the next request and whether the connection is
+        kept alive after it, None once the client closed the connection or
+        did not send a request head within `timeout` seconds """
+        request = await self.read_head(reader, writer, timeout)
+        if request is None:
+            return None
+        head, length = request
+        try:
+            body = await asyncio.wait_for(reader.readexactly(length), READ_TIMEOUT) \
+                if length else b''
+        except asyncio.TimeoutError:
+            await self.write_error(writer, '408 Request Timeout')
+            return None
+
+        environ = wsgi_environ(head, body, writer, peer)
+        _, _, version, headers = head
+
+        connection = headers.get('CONNECTION', '').lower()
+        keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+        return environ, keep_alive
+
+    async def respond(self, environ: dict, writer, keep_alive: bool) -> bool:
+        """ answers a request, returns whether the connection stays open """
+        loop = asyncio.get_running_loop()
+        wait = self.pop_wait(environ)
+        path = environ['PATH_INFO']
+
+        if wait and environ['REQUEST_METHOD'] == 'GET' and path.startswith(RESULTS_PREFIX):
+            # long poll: the app answers once the job is done or the wait expired
+            await self.pool.job_done(path[len(RESULTS_PREFIX):], wait)
+        elif wait and environ['REQUEST_METHOD'] == 'POST':
+            # job submission answered with the result when it is ready in time
+            status, headers, content = await loop.run_in_executor(
+                self.executor, read_body, self.app, environ)
+            job_id = self.submitted_job(status, content)
+            if job_id is None or not await self.pool.job_done(job_id, wait):
+                return await self.write_response(writer, status, headers, [content], keep_alive)
+            environ = dict(environ, REQUEST_METHOD='GET', PATH_INFO=RESULTS_PREFIX + job_id,
+                           QUERY_STRING='', CONTENT_LENGTH='', CONTENT_TYPE='',
+                           **{'wsgi.input': io.BytesIO()})
+
+        status, headers, chunk, body = await loop.run_in_executor(
+            self.executor, run_wsgi, self.app, environ)
+        return await self.write_response(writer, status, headers,
+                                         self.chunks(chunk, body), keep_alive)
+
+    def pop_wait(self, environ: dict) -> float:
+        """ the `wait` query parameter, bounded by max_wait and removed from
+        the request so that the app does not block a thread on it """
+        params = parse_qsl(environ['QUERY_STRING'], keep_blank_values=True)
+        wait = [value for name, value in params if name == 'wait']
+        if not wait:
+            return 0
+        environ['QUERY_STRING'] = urlencode([(name, value) for name, value in params
+                                             if name != 'wait'])
+        try:
+            return max(0.0, min(float(wait[-1]), self.max_wait))
+        except ValueError:
+            return 0
+
+    @staticmethod
+    def submitted_job(status: str, content: bytes) -> Optional[str]:
+        """ id of the job accepted by a submission response, if any """
+        if not status.startswith('200'):
+            return None
+        try:
+            job_id = json.loads(content).get('job_id')
+        except (ValueError, AttributeError):
+            return None
+        return job_id if isinstance(job_id, str) else None
+
+    async def chunks(self, chunk: Optional[bytes], body):
+        """ the chunks of a WSGI body, each one read on the executor """
+        loop = asyncio.get_running_loop()
+        chunks = iter(body)
+        while chunk is not None:
+            yield chunk
+            chunk = await loop.run_in_executor(self.executor, next_chunk, chunks, body)
+
+    async def write_response(self, writer, status: str, headers: list, chunks,
+                             keep_alive: bool) -> bool:
+        """ writes a response, returns whether the connection stays open; a
+        body without a Content-Length is delimited by closing the connection """
+        keep_alive = keep_alive and any(name.lower() == 'content-length' for name, _ in headers)
+        lines = [f'HTTP/1.1 {status}']
+        lines += [f'{name}: {value}' for name, value in headers
+                  if name.lower() != 'connection']
+        lines.append('Connection: keep-alive' if keep_alive else 'Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if hasattr(chunks, '__aiter__'):
+            async for chunk in chunks:
+                writer.write(chunk)
+                await writer.drain()
+        else:
+            for chunk in chunks:
+                writer.write(chunk)
+        await writer.drain()
+        return keep_alive
+
+    async def write_error(self, writer, status: str):
+        """ answers a malformed request and closes the connection """
+        await self.write_response(writer, status, [('Content-Length', '0')], [], False)
+
+
+async def serve_forever(front_end: AsyncFrontEnd, host: str, port: int):
+    """ runs the front end until the process is stopped """
+    server = await front_end.serve(host, port, int(os.getenv('ASYNC_BACKLOG', '1024')))
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    """ serves the webserver app, set by the ASYNC_* environment variables """
+    front_end = AsyncFrontEnd(webserver, webserver.tasks_runner, MAX_RESULT_WAIT,
+                              int(os.getenv('ASYNC_WSGI_THREADS', '16')))
+    asyncio.run(serve_forever(front_end, os.getenv('ASYNC_HOST', '127.0.0.1'),
+                              int(os.getenv('ASYNC_PORT', '5000'))))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,58 @@
 """" This module contains the DataIngestor class with
   the functionality to ingest data from a csv file
  """
+import copy
 import logging
+import os
 
 import pandas as pd
 
-
-class DataIngestor:
-    """ Data Ingestor class """
-
-    def __init__(self, csv_path: str):
+from app import snapshot
+
+from app.aggregate_index import (AggregateIndex, CATEGORY_COLUMNS, QUESTION_COLUMN,
+                                 VALUE_COLUMN)
+
+# columns dictionary-encoded as categoricals by the compact load mode
+ENCODED_COLUMNS = [QUESTION_COLUMN] + CATEGORY_COLUMNS
+# the only columns the endpoints need
+COMPACT_COLUMNS = ENCODED_COLUMNS + [VALUE_COLUMN]
+
+# endpoints which can be part of a batch, mapped to whether they take a state
+QUERY_ENDPOINTS = {
+    'states_mean': False,
+    'state_mean': True,
+    'best5': False,
+    'worst5': False,
+    'global_mean': False,
+    'diff_from_mean': False,
+    'state_diff_from_mean': True,
+    'mean_by_category': False,
+    'state_mean_by_category': True,
+}
+
+
+def tuple_keys(index: pd.MultiIndex) -> list:
+    """ "('<level 0>', '<level 1>', ...)" keys of the entries of an index,
+    built a whole level at a time """
+    keys = "('" + index.get_level_values(0).astype(str)
+    for level in range(1, index.nlevels):
+        keys = keys + "', '" + index.get_level_values(level).astype(str)
+    return (keys + "')").tolist()
+
+
+# pylint: disable-next=too-many-instance-attributes
+class DataIngestor:  # the dataset, its index and the best-question lists
+    """ Data Ingestor class; the index of an ingestor is never replaced once
+    it serves queries, a dataset version is a new ingestor """
+
+    def __init__(self, csv_path: str, compact: bool = True, version: int = 1):
         self.csv_path = csv_path
+        self.compact = compact
         self.df = None
+        self.index = None
         self.logger = logging.getLogger('webserver')
+        # rows added by with_rows since the csv was loaded
+        self.appended_rows = 0
 
         self.questions_best_is_min = [
             'Percent of adults aged 18 years and older who have an overweight classification',
@@ -39,70 +79,129 @@ class DataIngestor:
             'Percent of adults who engage in muscle-strengthening \
             activities on 2 or more days a week',
         ]
-        self.read_file()
+        # with DATA_CHUNK_ROWS=<rows> the csv is streamed into the aggregates
+        # and the frame of the whole dataset is never built
+        chunk_rows = int(os.getenv('DATA_CHUNK_ROWS', '0'))
+        if chunk_rows > 0:
+            self.index = AggregateIndex.from_chunks(self.read_chunks(chunk_rows), version)
+        else:
+            self.read_file()
+            self.index = AggregateIndex.from_frame(self.df, version)
+        self.logger.info("Built aggregate index of %d questions, version %d",
+                         len(self.index.questions), version)
+
+    @property
+    def version(self) -> int:
+        """ version of the dataset the methods are answered from """
+        return self.index.version
 
     def read_file(self):
         """" a method to read the csv file safely"""
         try:
-            self.df = pd.read_csv(self.csv_path)
+            if self.compact:
+                self.df = self._read_compact()
+            else:
+                self.df = pd.read_csv(self.csv_path)
             self.logger.info("Read file %s", self.csv_path)
             return self.df
         except Exception as e:
             self.logger.error("Error reading file %s:%s", self.csv_path, str(e))
             raise
 
+    def read_chunks(self, chunk_rows: int):
+        """ yields the used columns of the csv, `chunk_rows` rows at a time """
+        try:
+            with pd.read_csv(self.csv_path, usecols=COMPACT_COLUMNS, chunksize=chunk_rows,
+                             dtype={column: str for column in ENCODED_COLUMNS}) as reader:
+                for chunk in reader:
+                    chunk[VALUE_COLUMN] = pd.to_numeric(chunk[VALUE_COLUMN], errors='coerce')
+                    yield chunk
+            self.logger.info("Streamed file %s", self.csv_path)
+        except Exception as e:
+            self.logger.error("Error reading file %s:%s", self.csv_path, str(e))
+            raise
+
+    def _read_compact(self) -> pd.DataFrame:
+        """ maps the binary snapshot of the compact frame, or parses the csv
+        and writes the snapshot when it is missing or stale """
+        if os.getenv('DATA_SNAPSHOT', '1') == '0':
+            return self._parse_compact()
+
+        source = snapshot.fingerprint(self.csv_path)
+        path = snapshot.snapshot_path(self.csv_path)
+        df = snapshot.load_snapshot(path, source)
+        if df is not None:
+            self.logger.info("Mapped snapshot %s", path)
+            return df
+
+        df = self._parse_compact()
+        try:
+            snapshot.write_snapshot(df, path, source)
+            self.logger.info("Wrote snapshot %s", path)
+        except OSError as e:
+            self.logger.warning("Could not write snapshot %s: %s", path, str(e))
+        return df
+
+    def _parse_compact(self) -> pd.DataFrame:
+        """ keeps only the used columns, with the text columns as categoricals
+        and Data_Value parsed once into floats """
+        df = pd.read_csv(self.csv_path, usecols=COMPACT_COLUMNS,
+                         dtype={column: 'category' for column in ENCODED_COLUMNS})
+        df[VALUE_COLUMN] = pd.to_numeric(df[VALUE_COLUMN], errors='coerce').astype('float64')
+        return df
+
+    def with_rows(self, rows: list) -> 'DataIngestor':
+        """ ingestor of the next dataset version, holding the aggregates of
+        this one with survey rows, given as dicts holding the COMPACT_COLUMNS,
+        added; this ingestor is left unchanged and the rows are kept in
+        memory only, the csv is left unchanged """
+        batch = pd.DataFrame.from_records(rows, columns=COMPACT_COLUMNS)
+        batch[VALUE_COLUMN] = pd.to_numeric(batch[VALUE_COLUMN], errors='coerce')
+        appended = copy.copy(self)
+        appended.index = self.index.append(batch)
+        appended.appended_rows = self.appended_rows + len(batch)
+        self.logger.info("Appended %d rows, version %d", len(batch), appended.version)
+        return appended
+
     def validate_question(self, question: str) -> bool:
         """"method to validate the question"""
         return question in self.questions_best_is_min or question in self.questions_best_is_max
 
     def states_mean(self, question: str, ):
         """"this method responsible for returning the states mean"""
-        result = self.df[self.df['Question'] == question].copy()
-        result.loc[:, 'Data_Value'] = pd.to_numeric(result['Data_Value'], errors='coerce')
-        average = result.groupby('LocationDesc')['Data_Value'].mean().dropna()
+        average = self.index.get(question).state_means().dropna()
         sorted_states = average.sort_values().to_dict()
         return sorted_states
 
     def state_mean(self, question: str, state: str):
         """"this method responsible for returning the state mean"""
-        result = self.df[(self.df['Question'] == question) &
-                         (self.df['LocationDesc'] == state)].copy()
-        result.loc[:, 'Data_Value'] = pd.to_numeric(result['Data_Value'], errors='coerce')
-        mean_value = result['Data_Value'].mean()
+        mean_value = self.index.get(question).state_mean(state)
         return {state: mean_value} if mean_value is not None else {state: None}
 
     def best5(self, question: str):
         """"this method responsible for returning the best 5 states"""
-        result = self.df[self.df['Question'] == question].copy()
-        result.loc[:, 'Data_Value'] = pd.to_numeric(result['Data_Value'], errors='coerce')
-        average = result.groupby('LocationDesc')['Data_Value'].mean().dropna()
+        average = self.index.get(question).state_means().dropna()
         if question in self.questions_best_is_min:
             return average.nsmallest(5).to_dict()
         return average.nlargest(5).to_dict()
 
     def worst5(self, question: str):
         """"this method responsible for returning the worst 5 states"""
-        result = self.df[self.df['Question'] == question].copy()
-        result.loc[:, 'Data_Value'] = pd.to_numeric(result['Data_Value'], errors='coerce')
-        average = result.groupby('LocationDesc')['Data_Value'].mean().dropna()
+        average = self.index.get(question).state_means().dropna()
         if question in self.questions_best_is_min:
             return average.nlargest(5).to_dict()
         return average.nsmallest(5).to_dict()
 
     def global_mean(self, question: str):
         """"this method responsible for returning the global mean"""
-        result = self.df[self.df['Question'] == question].copy()
-        result.loc[:, 'Data_Value'] = pd.to_numeric(result['Data_Value'], errors='coerce')
-
-        global_mean_value = result['Data_Value'].mean()
+        global_mean_value = self.index.get(question).global_mean()
         return {"global_mean": global_mean_value}
 
     def diff_from_mean(self, question: str):
         """""this method responsible for returning the diff from mean"""
-        result = self.df[self.df['Question'] == question].copy()
-        result.loc[:, 'Data_Value'] = pd.to_numeric(result['Data_Value'], errors='coerce')
-        state_means = result.groupby('LocationDesc')['Data_Value'].mean().dropna()
-        global_mean_value = result['Data_Value'].mean()
+        aggregates = self.index.get(question)
+        state_means = aggregates.state_means().dropna()
+        global_mean_value = aggregates.global_mean()
 
         diff_dict = (global_mean_value - state_means).sort_values().to_dict()
         return diff_dict
@@ -114,42 +213,29 @@ class DataIngestor:
 
     def mean_by_category(self, question: str):
         """"this method responsible for returning the mean by category"""
-        result = self.df[self.df['Question'] == question].copy()
-        result.loc[:, 'Data_Value'] = pd.to_numeric(result['Data_Value'],
-                                                    errors='coerce')
-
-        mean_values = result.groupby(['LocationDesc', 'StratificationCategory1',
-                                      'Stratification1'])[
-            'Data_Value'].mean().reset_index()
-        mean_by_category_dict = {}
-
-        for _, row in mean_values.iterrows():
-            state = row['LocationDesc']
-            category = row['StratificationCategory1']
-            stratification = row['Stratification1']
-            mean_value = row['Data_Value']
-            key = f"('{state}', '{category}', '{stratification}')"
-            mean_by_category_dict[key] = mean_value
-
-        return mean_by_category_dict
+        means = self.index.get(question).category_means()
+        return dict(zip(tuple_keys(means.index), means.tolist()))
 
     def state_mean_by_category(self, question: str, state: str):
         """""this method responsible for returning the state mean by category"""
-        result = self.df[(self.df['Question'] == question) &
-                         (self.df['LocationDesc'] == state)].copy()
-        result.loc[:, 'Data_Value'] = pd.to_numeric(result['Data_Value'],
-                                                    errors='coerce')
-        # Group by category and stratification, then calculate the mean
-        mean_values = result.groupby(['StratificationCategory1',
-                                      'Stratification1'])['Data_Value'].mean().reset_index()
-        state_dict = {}
-        # Create a dictionary with the key as a tuple of category and stratification
-        for _, row in mean_values.iterrows():
-            category = row['StratificationCategory1']
-            stratification = row['Stratification1']
-
-            mean_value = row['Data_Value']
-            key = f"('{category}', '{stratification}')"
-            state_dict[key] = mean_value
-
-        return {state: state_dict}
+        means = self.index.get(question).state_category_means(state)
+        return {state: dict(zip(tuple_keys(means.index), means.tolist()))}
+
+    def batch(self, queries: list):
+        """"this method answers a list of queries in order; the queries are
+        grouped by question so that the means of each question are derived
+        once and shared by all its queries"""
+        results = [None] * len(queries)
+        positions_by_question = {}
+        for position, query in enumerate(queries):
+            positions_by_question.setdefault(query['question'], []).append(position)
+
+        for question, positions in positions_by_question.items():
+            for position in positions:
+                query = queries[position]
+                method = getattr(self, query['endpoint'])
+                if QUERY_ENDPOINTS[query['endpoint']]:
+                    results[position] = method(question, query['state'])
+                else:
+                    results[position] = method(question)
+        return results
@@ -0,0 +1,110 @@
+"""" This module contains the DatasetReloader class, which loads a new
+  version of the dataset in the background and swaps it in for the new jobs
+ """
+import logging
+import os
+import time
+from threading import Lock, Thread
+from typing import Callable, Optional
+
+from app.data_ingestor import DataIngestor
+
+
+def file_signature(path: str) -> Optional[tuple]:
+    """ (size, mtime) of a file, None if it does not exist """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class DatasetReloader:
+    """ Reloads the csv of a DataIngestor into a new ingestor with the next
+    version, then hands it to `on_swap`; jobs hold the ingestor they were
+    submitted with, so they finish on that version """
+
+    def __init__(self, data_ingestor: DataIngestor,
+                 on_swap: Callable[[DataIngestor], None]):
+        self.data_ingestor = data_ingestor
+        self.on_swap = on_swap
+        self.loaded_at = time.time()
+        self.last_error = None
+        self.logger = logging.getLogger('webserver')
+        # held for the whole reload, a single reload runs at a time
+        self._lock = Lock()
+        # held while a new version is published, so that versions are
+        # numbered in the order they are swapped in
+        self._swap_lock = Lock()
+
+    def reload(self) -> bool:
+        """ loads the csv and swaps the new version in; returns False when
+        another reload is running, the current version is kept on errors """
+        # pylint: disable-next=consider-using-with
+        if not self._lock.acquire(blocking=False):  # a running reload is not waited for
+            return False
+        try:
+            current = self.data_ingestor
+            self.logger.info('Reloading %s', current.csv_path)
+            try:
+                reloaded = DataIngestor(current.csv_path, current.compact, current.version + 1)
+            except (OSError, ValueError, KeyError) as e:
+                self.logger.error('Reload of %s failed: %s', current.csv_path, str(e))
+                self.last_error = str(e)
+                return True
+            with self._swap_lock:
+                if reloaded.version <= self.data_ingestor.version:
+                    # rows were appended while the csv was loaded
+                    reloaded.index.version = self.data_ingestor.version + 1
+                self.on_swap(reloaded)
+                self.data_ingestor = reloaded
+            self.loaded_at = time.time()
+            self.last_error = None
+            self.logger.info('Swapped in dataset version %d', reloaded.version)
+            return True
+        finally:
+            self._lock.release()
+
+    def append(self, rows: list) -> int:
+        """ swaps in the dataset in use with survey rows added, as the next
+        version, and returns that version; jobs submitted before keep
+        answering from the version they were submitted with """
+        with self._swap_lock:
+            appended = self.data_ingestor.with_rows(rows)
+            self.on_swap(appended)
+            self.data_ingestor = appended
+        return appended.version
+
+    def reload_in_background(self) -> bool:
+        """ starts a reload in a thread, returns False when one is running """
+        if self._lock.locked():
+            return False
+        Thread(target=self.reload, daemon=True).start()
+        return True
+
+    def watch(self, interval: float):
+        """ reloads the dataset in the background whenever its csv changes;
+        a change is picked up once the file stayed the same for `interval` seconds """
+        Thread(target=self._watch, args=(interval,), daemon=True).start()
+
+    def _watch(self, interval: float):
+        loaded = file_signature(self.data_ingestor.csv_path)
+        previous = loaded
+        while True:
+            time.sleep(interval)
+            signature = file_signature(self.data_ingestor.csv_path)
+            if signature is not None and signature == previous and signature != loaded:
+                self.reload()
+                loaded = signature
+            previous = signature
+
+    def status(self) -> dict:
+        """ version, source and load time of the dataset in use """
+        return {
+            'version': self.data_ingestor.version,
+            'appended_rows': self.data_ingestor.appended_rows,
+            'csv_path': self.data_ingestor.csv_path,
+            'loaded_at': self.loaded_at,
+            'reloading': self._lock.locked(),
+            'last_error': self.last_error,
+        }
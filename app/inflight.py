@@ -0,0 +1,75 @@
+"""" This module contains the InFlightJobs class which tracks the queued
+  and running jobs: their completion events, and the identical jobs
+  coalesced into a single computation
+ """
+from threading import Event, Lock
+from typing import Callable, Hashable, Optional
+
+
+class InFlightJobs:
+    """ Queued and running jobs """
+
+    def __init__(self):
+        # job_id -> Event set when the job finishes
+        self._events = {}
+        # job_id -> callbacks called when the job finishes
+        self._callbacks = {}
+        # query key -> ids of the jobs waiting for that computation, leader first
+        self._groups = {}
+        self._lock = Lock()
+        self.coalesced_jobs = 0
+
+    def add(self, job_id: str, key: Optional[Hashable]) -> bool:
+        """ registers a new job; returns False when an identical job is
+        already queued or running, in which case the new job receives its
+        result instead of being computed """
+        with self._lock:
+            self._events[job_id] = Event()
+            if key is None:
+                return True
+            group = self._groups.get(key)
+            if group is not None:
+                group.append(job_id)
+                self.coalesced_jobs += 1
+                return False
+            self._groups[key] = [job_id]
+            return True
+
+    def finish(self, job_id: str, key: Optional[Hashable]) -> list:
+        """ ids of the jobs answered by the computation of a job; later
+        identical jobs start a new computation """
+        if key is None:
+            return [job_id]
+        with self._lock:
+            return self._groups.pop(key, [job_id])
+
+    def notify_done(self, job_id: str):
+        """ wakes up the clients waiting for a job """
+        with self._lock:
+            done_event = self._events.pop(job_id, None)
+            callbacks = self._callbacks.pop(job_id, ())
+        if done_event is not None:
+            done_event.set()
+        for callback in callbacks:
+            callback()
+
+    def add_done_callback(self, job_id: str, callback: Callable[[], None]) -> bool:
+        """ calls `callback`, from the thread finishing the job, when a job
+        finishes; returns False for a job which is not queued or running here """
+        with self._lock:
+            if job_id not in self._events:
+                return False
+            self._callbacks.setdefault(job_id, []).append(callback)
+            return True
+
+    def wait(self, job_id: str, timeout: float) -> bool:
+        """ blocks until a job finishes or the timeout expires; returns False
+        without waiting for a job which is not queued or running here """
+        done_event = self._events.get(job_id)
+        if done_event is None:
+            return False
+        done_event.wait(timeout)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._events)
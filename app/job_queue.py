@@ -0,0 +1,155 @@
+"""" This module contains the JobQueue class, the bounded job queue of the
+  thread pool; jobs are queued in priority classes, and within a class the
+  clients are served in turn
+ """
+from collections import OrderedDict, deque
+from queue import Empty
+from threading import Condition
+from time import monotonic
+from typing import Any, Hashable, Optional
+
+# priority classes, served first to last
+PRIORITY_CLASSES = ('high', 'normal', 'low')
+
+
+class QueueFullError(Exception):
+    """ Raised when a job is rejected because the queue is saturated """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+# pylint: disable-next=too-many-instance-attributes
+class JobQueue:  # bounds, per-class queues and the counters read by /api/metrics
+    """ Job queue bounded in depth, overall and per client. The next job is
+    taken from the class with the best priority, where every `aging`
+    seconds spent waiting raises a job by one class, so that low priority
+    jobs are not starved; inside a class the clients are served round-robin """
+
+    def __init__(self, max_depth: int = 0, max_client_depth: int = 0, aging: float = 1.0):
+        # 0 means unbounded
+        self.max_depth = max_depth
+        self.max_client_depth = max_client_depth
+        self.aging = aging
+        # class -> client -> deque of (enqueued_at, job), clients in serving order
+        self._classes = {name: OrderedDict() for name in PRIORITY_CLASSES}
+        # client -> number of queued jobs
+        self._client_depths = {}
+        self._size = 0
+        self._unfinished = 0
+        self._not_empty = Condition()
+        self._all_done = Condition(self._not_empty)
+        self.rejections = {'queue_full': 0, 'client_limit': 0}
+        # class -> served jobs, total and max seconds they waited in the queue
+        self.waits = {name: {'jobs': 0, 'total': 0.0, 'max': 0.0} for name in PRIORITY_CLASSES}
+
+    def put(self, item: Any, client: Hashable = None, priority: str = 'normal'):
+        """ enqueues a job, raises QueueFullError when the queue or the
+        client's share of it is full """
+        if priority not in self._classes:
+            raise ValueError(f'Unknown priority class {priority}')
+        with self._not_empty:
+            client_depth = self._client_depths.get(client, 0)
+            if self.max_depth and self._size >= self.max_depth:
+                self.rejections['queue_full'] += 1
+                raise QueueFullError('queue_full')
+            if self.max_client_depth and client_depth >= self.max_client_depth:
+                self.rejections['client_limit'] += 1
+                raise QueueFullError('client_limit')
+            clients = self._classes[priority]
+            if client not in clients:
+                clients[client] = deque()
+            clients[client].append((monotonic(), item))
+            self._client_depths[client] = client_depth + 1
+            self._size += 1
+            self._unfinished += 1
+            self._not_empty.notify()
+
+    def _next_class(self, now: float) -> str:
+        """ the class holding the job to serve next, its priority improved
+        by the time its next job has waited """
+        best_name, best_priority = None, None
+        for rank, name in enumerate(PRIORITY_CLASSES):
+            clients = self._classes[name]
+            if not clients:
+                continue
+            enqueued_at = next(iter(clients.values()))[0][0]
+            priority = rank - (now - enqueued_at) / self.aging if self.aging > 0 else rank
+            if best_priority is None or priority < best_priority:
+                best_name, best_priority = name, priority
+        return best_name
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """ dequeues the next job, raises queue.Empty when no job arrives
+        before the timeout """
+        with self._not_empty:
+            deadline = None if timeout is None else monotonic() + timeout
+            while not self._size:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise Empty
+                self._not_empty.wait(remaining)
+
+            now = monotonic()
+            name = self._next_class(now)
+            clients = self._classes[name]
+            client, jobs = next(iter(clients.items()))
+            enqueued_at, item = jobs.popleft()
+            if jobs:
+                clients.move_to_end(client)
+            else:
+                del clients[client]
+            self._client_depths[client] -= 1
+            if not self._client_depths[client]:
+                del self._client_depths[client]
+            self._size -= 1
+
+            waited = now - enqueued_at
+            waits = self.waits[name]
+            waits['jobs'] += 1
+            waits['total'] += waited
+            waits['max'] = max(waits['max'], waited)
+            return item
+
+    def task_done(self):
+        """ marks a dequeued job as finished """
+        with self._all_done:
+            self._unfinished -= 1
+            if self._unfinished <= 0:
+                self._all_done.notify_all()
+
+    def join(self):
+        """ blocks until every enqueued job is finished """
+        with self._all_done:
+            while self._unfinished:
+                self._all_done.wait()
+
+    def qsize(self) -> int:
+        """ number of queued jobs """
+        return self._size
+
+    def empty(self) -> bool:
+        """ whether no job is queued """
+        return self._size == 0
+
+    def stats(self) -> dict:
+        """ depth, bounds, rejection counters and waits per class of the queue """
+        with self._not_empty:
+            classes = {}
+            for name, clients in self._classes.items():
+                waits = self.waits[name]
+                classes[name] = {
+                    'depth': sum(len(jobs) for jobs in clients.values()),
+                    'served': waits['jobs'],
+                    'mean_wait': waits['total'] / waits['jobs'] if waits['jobs'] else 0.0,
+                    'max_wait': waits['max'],
+                }
+            return {
+                'depth': self.qsize(),
+                'clients': len(self._client_depths),
+                'max_depth': self.max_depth,
+                'max_client_depth': self.max_client_depth,
+                'rejected': dict(self.rejections),
+                'classes': classes,
+            }
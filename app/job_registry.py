@@ -0,0 +1,197 @@
+"""" This module contains the job registries, which allocate the job ids
+  and keep the state and timestamps of every job
+ """
+import os
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right, insort
+from threading import Lock
+from typing import NamedTuple, Optional
+
+JOB_STATES = ('queued', 'running', 'done', 'error')
+
+
+class JobRecord(NamedTuple):
+    """ State of a job, replaced on every transition """
+    job_id: str
+    endpoint: str
+    status: str
+    submitted_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    reason: Optional[str] = None
+    # dataset version the job is computed on
+    version: Optional[int] = None
+    # submission sequence number, the cursor of the pages of jobs
+    seq: Optional[int] = None
+
+
+class JobRegistry(ABC):
+    """ Interface of the job registries """
+
+    @abstractmethod
+    def next_job_id(self) -> str:
+        """ allocates a new job id """
+
+    @abstractmethod
+    def queued(self, job_id: str, endpoint: str, version: Optional[int] = None):
+        """ records a job accepted in the queue """
+
+    @abstractmethod
+    def running(self, job_id: str):
+        """ records a job taken by a task runner """
+
+    @abstractmethod
+    def done(self, job_id: str):
+        """ records a job whose result is stored """
+
+    @abstractmethod
+    def failed(self, job_id: str, reason: str):
+        """ records a job which ended with an error """
+
+    @abstractmethod
+    def discard(self, job_id: str):
+        """ forgets a job which was not accepted after all """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        """ the record of a job, None for an unknown job """
+
+    @abstractmethod
+    def list_jobs(self, status: Optional[str] = None, after: int = 0,
+                  limit: int = 100) -> tuple[int, list]:
+        """ (total, page of records) of the jobs, optionally in one state, in
+        submission order; the page holds the jobs whose `seq` is above `after` """
+
+    @abstractmethod
+    def counts(self) -> dict:
+        """ number of jobs in every state """
+
+
+class JobList:
+    """ Sequence numbers of jobs in ascending order; the jobs are nearly always
+    added at the end and removed from the start, which takes amortized
+    constant time, while a job elsewhere moves the numbers which follow it """
+
+    def __init__(self):
+        self._seqs = []
+        # number of removed entries at the start of _seqs
+        self._start = 0
+
+    def __len__(self) -> int:
+        return len(self._seqs) - self._start
+
+    @property
+    def first(self) -> Optional[int]:
+        """ the lowest sequence number, None when empty """
+        return self._seqs[self._start] if len(self) else None
+
+    def add(self, seq: int):
+        """ adds a job """
+        if not self._seqs or seq > self._seqs[-1]:
+            self._seqs.append(seq)
+        else:
+            insort(self._seqs, seq, self._start)
+
+    def remove(self, seq: int):
+        """ removes a job """
+        index = bisect_left(self._seqs, seq, self._start)
+        if index > self._start:
+            del self._seqs[index]
+            return
+        self._start += 1
+        if 2 * self._start >= len(self._seqs):
+            del self._seqs[:self._start]
+            self._start = 0
+
+    def page(self, after: int, limit: int) -> list:
+        """ up to `limit` sequence numbers above `after` """
+        index = bisect_right(self._seqs, after, self._start)
+        return self._seqs[index:index + limit]
+
+
+# pylint: disable-next=too-many-instance-attributes
+class MemoryJobRegistry(JobRegistry):  # the lists indexing the records are attributes too
+    """ In-process registry of the jobs, keeping the last `max_jobs` ones """
+
+    def __init__(self, max_jobs: int = 1000000):
+        self.max_jobs = max_jobs
+        self._next_number = 1
+        self._next_seq = 1
+        # job_id -> JobRecord
+        self._records = {}
+        # seq -> job_id
+        self._job_ids = {}
+        # all the jobs, oldest first
+        self._submitted = JobList()
+        # state -> the jobs in that state
+        self._by_state = {state: JobList() for state in JOB_STATES}
+        self._lock = Lock()
+
+    def next_job_id(self) -> str:
+        with self._lock:
+            number = self._next_number
+            self._next_number += 1
+        return f'job_id_{number}'
+
+    def _forget(self, record: JobRecord):
+        del self._records[record.job_id]
+        del self._job_ids[record.seq]
+        self._submitted.remove(record.seq)
+        self._by_state[record.status].remove(record.seq)
+
+    def queued(self, job_id: str, endpoint: str, version: Optional[int] = None):
+        with self._lock:
+            if job_id in self._records:
+                self._forget(self._records[job_id])
+            record = JobRecord(job_id, endpoint, 'queued', time.time(), version=version,
+                               seq=self._next_seq)
+            self._next_seq += 1
+            self._records[job_id] = record
+            self._job_ids[record.seq] = job_id
+            self._submitted.add(record.seq)
+            self._by_state['queued'].add(record.seq)
+            while len(self._records) > self.max_jobs:
+                self._forget(self._records[self._job_ids[self._submitted.first]])
+
+    def _transition(self, job_id: str, status: str, **changes):
+        with self._lock:
+            record = self._records.get(job_id)
+            if record is not None:
+                self._by_state[record.status].remove(record.seq)
+                self._records[job_id] = record._replace(status=status, **changes)
+                self._by_state[status].add(record.seq)
+
+    def running(self, job_id: str):
+        self._transition(job_id, 'running', started_at=time.time())
+
+    def done(self, job_id: str):
+        self._transition(job_id, 'done', finished_at=time.time())
+
+    def failed(self, job_id: str, reason: str):
+        self._transition(job_id, 'error', finished_at=time.time(), reason=reason)
+
+    def discard(self, job_id: str):
+        with self._lock:
+            record = self._records.get(job_id)
+            if record is not None:
+                self._forget(record)
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        return self._records.get(job_id)
+
+    def list_jobs(self, status: Optional[str] = None, after: int = 0,
+                  limit: int = 100) -> tuple[int, list]:
+        with self._lock:
+            jobs = self._submitted if status is None else self._by_state[status]
+            page = [self._records[self._job_ids[seq]] for seq in jobs.page(after, limit)]
+            return len(jobs), page
+
+    def counts(self) -> dict:
+        with self._lock:
+            return {state: len(job_ids) for state, job_ids in self._by_state.items()}
+
+
+def create_job_registry() -> JobRegistry:
+    """ job registry sized by the JOB_HISTORY environment variable """
+    return MemoryJobRegistry(int(os.getenv('JOB_HISTORY', '1000000')))
@@ -0,0 +1,91 @@
+"""" This module sets up the logging of the webserver: the records are
+  handed to a queue without being formatted, and a listener thread formats
+  them and writes them to a size-rotated log file
+ """
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = ('%(asctime)s - %(name)s - %(levelname)s - %(message)s '
+              '(LINE:%(lineno)d) FILE:%(filename)s')
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S %Z'
+
+
+class DroppingQueueHandler(QueueHandler):
+    """ Queue handler which never blocks the logging thread: records are
+    queued as they are, formatted by the listener, and dropped when the
+    queue is full """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the listener runs in this process, so the record needs no pickling
+        # and its message is built by the file handler, off the hot path
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+# pylint: disable-next=too-few-public-methods
+class SamplingFilter(logging.Filter):  # logging only calls filter()
+    """ Keeps a `rate` fraction of the records below WARNING of a logger,
+    evenly spread; warnings and errors are always kept """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+        self._credit = 0.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        self._credit += self.rate
+        if self._credit < 1:
+            return False
+        self._credit -= 1
+        return True
+
+
+def parse_logger_settings(value: str) -> dict:
+    """ logger name -> setting of a 'name=setting,name=setting' variable """
+    settings = {}
+    for item in value.split(','):
+        name, _, setting = item.strip().partition('=')
+        if setting:
+            settings[name.strip()] = setting.strip()
+    return settings
+
+
+def setup_logging() -> QueueListener:
+    """ configures the root logger from the LOG_* environment variables and
+    starts the listener thread writing the log file """
+    file_handler = RotatingFileHandler(
+        os.getenv('LOG_FILE', 'webserver.log'),
+        maxBytes=int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024))),
+        backupCount=int(os.getenv('LOG_BACKUPS', '5')))
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+
+    log_queue = queue.Queue(int(os.getenv('LOG_QUEUE_SIZE', '10000')))
+    root = logging.getLogger()
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    # e.g. LOG_LEVELS=werkzeug=WARNING,webserver=INFO
+    for name, level in parse_logger_settings(os.getenv('LOG_LEVELS', '')).items():
+        logging.getLogger(name).setLevel(level.upper())
+    # e.g. LOG_SAMPLING=webserver=0.1 keeps one in ten info records of the webserver
+    for name, rate in parse_logger_settings(os.getenv('LOG_SAMPLING', '')).items():
+        logging.getLogger(name).addFilter(SamplingFilter(float(rate)))
+
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    # flushes the queued records when the server exits
+    atexit.register(listener.stop)
+    return listener
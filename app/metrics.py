@@ -0,0 +1,205 @@
+"""" This module contains the Metrics class, which records the counters and
+  histograms of the webserver and renders them in the Prometheus text
+  format
+ """
+import threading
+import weakref
+from bisect import bisect_left
+from time import monotonic
+
+# upper bounds, in seconds, of the buckets of the duration histograms
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# name -> (type, help) of the exported metrics
+METRIC_HELP = {
+    'webserver_requests_total': ('counter', 'HTTP requests by endpoint and status code'),
+    'webserver_job_queue_wait_seconds': (
+        'histogram', 'Time jobs waited in the queue, by DataIngestor method'),
+    'webserver_job_execution_seconds': (
+        'histogram', 'Time task runners spent on a job, by DataIngestor method'),
+    'webserver_worker_busy_seconds_total': ('counter', 'Time a task runner spent on jobs'),
+    'webserver_worker_busy_ratio': (
+        'gauge', 'Fraction of the uptime a task runner spent on jobs'),
+    'webserver_uptime_seconds': ('gauge', 'Seconds since the metrics started'),
+    'webserver_queue_depth': ('gauge', 'Jobs in the queue, by priority class'),
+    'webserver_queue_rejected_total': ('counter', 'Jobs rejected by the queue, by reason'),
+    'webserver_jobs': ('gauge', 'Jobs known to the job registry, by state'),
+    'webserver_inline_results_total': (
+        'counter', 'Results returned by the submitting request, by method and source'),
+    'webserver_coalesced_jobs_total': (
+        'counter', 'Jobs answered by an identical running computation'),
+    'webserver_result_store_entries': ('gauge', 'Results held by the result store'),
+    'webserver_result_store_bytes': ('gauge', 'Bytes of the results held in memory'),
+    'webserver_result_cache_requests_total': ('counter', 'Result cache lookups, by outcome'),
+    'webserver_result_cache_evictions_total': ('counter', 'Results evicted from the cache'),
+    'webserver_result_cache_hit_ratio': ('gauge', 'Fraction of the cache lookups which hit'),
+    'webserver_result_cache_bytes': ('gauge', 'Bytes of the results held by the cache'),
+}
+
+
+def format_labels(labels: tuple) -> str:
+    """ Prometheus label set of a tuple of (name, value) pairs """
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def add_values(totals: dict, values: dict):
+    """ adds counters and histograms keyed by (name, labels) into totals """
+    for key, value in list(values.items()):
+        if isinstance(value, list):
+            total = totals.setdefault(key, [0] * len(value))
+            for i, count in enumerate(value):
+                total[i] += count
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+class Metrics:
+    """ Counters and histograms recorded without locks: every thread updates
+    its own shard, and the shards are summed when the metrics are rendered;
+    the shard of a thread is folded into a retired total when the thread
+    exits, so threads started per request do not keep a shard each """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.started_at = monotonic()
+        self._local = threading.local()
+        self._shards = []
+        # values recorded by the threads which exited
+        self._retired = {}
+        # only taken when a thread records its first value or exits
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            # the thread object is released once the thread exited
+            weakref.finalize(threading.current_thread(), self._retire, shard)
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _retire(self, shard: dict):
+        """ folds the shard of a thread which exited into the retired total """
+        with self._shards_lock:
+            add_values(self._retired, shard)
+            self._shards.remove(shard)
+
+    def shard_count(self) -> int:
+        """ number of live shards, one per thread which recorded a value """
+        with self._shards_lock:
+            return len(self._shards)
+
+    def inc(self, name: str, labels: tuple = (), amount: float = 1):
+        """ adds to a counter """
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name: str, labels: tuple, value: float):
+        """ records a value in a histogram """
+        shard = self._shard()
+        key = (name, labels)
+        # bucket counts, the count of the values over the last bound, their sum
+        histogram = shard.get(key)
+        if histogram is None:
+            histogram = shard[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def collect(self) -> dict:
+        """ (name, labels) -> value or histogram, summed over the threads """
+        totals = {}
+        with self._shards_lock:
+            shards = list(self._shards)
+            add_values(totals, self._retired)
+        for shard in shards:
+            add_values(totals, shard)
+        return totals
+
+    def uptime(self) -> float:
+        """ seconds since the metrics started """
+        return monotonic() - self.started_at
+
+    def render(self, samples: list) -> str:
+        """ the recorded metrics and the given (name, labels, value) samples
+        in the Prometheus text format """
+        families = {}
+        for (name, labels), value in self.collect().items():
+            families.setdefault(name, []).append((labels, value))
+        for name, labels, value in samples:
+            families.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name in sorted(families):
+            metric_type, help_text = METRIC_HELP.get(name, ('untyped', name))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in sorted(families[name], key=lambda sample: sample[0]):
+                if metric_type == 'histogram':
+                    lines.extend(self._histogram_lines(name, labels, value))
+                else:
+                    lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def _histogram_lines(self, name: str, labels: tuple, histogram: list) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), histogram):
+            cumulative += count
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {histogram[-1]}')
+        lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+        return lines
+
+
+# metrics of the webserver process
+METRICS = Metrics()
+
+
+def pool_samples(metrics: Metrics, pool) -> list:
+    """ gauges of the task runners, the job queue and the coalescing of a
+    ThreadPool """
+    uptime = metrics.uptime()
+    busy = metrics.collect()
+    samples = [('webserver_uptime_seconds', (), uptime)]
+    for runner in pool.runners:
+        labels = (('worker', runner.name),)
+        busy_seconds = busy.get(('webserver_worker_busy_seconds_total', labels), 0)
+        samples.append(('webserver_worker_busy_ratio', labels,
+                        busy_seconds / uptime if uptime > 0 else 0.0))
+
+    queue_stats = pool.job_queue.stats()
+    for name, class_stats in queue_stats['classes'].items():
+        samples.append(('webserver_queue_depth', (('priority', name),), class_stats['depth']))
+    for reason, count in queue_stats['rejected'].items():
+        samples.append(('webserver_queue_rejected_total', (('reason', reason),), count))
+    samples.append(('webserver_coalesced_jobs_total', (), pool.inflight.coalesced_jobs))
+    return samples
+
+
+def store_samples(job_registry, result_store, result_cache) -> list:
+    """ gauges of the job registry, the result store and the result cache """
+    samples = [('webserver_jobs', (('state', state),), count)
+               for state, count in job_registry.counts().items()]
+
+    store_stats = result_store.stats()
+    samples.append(('webserver_result_store_entries', (), store_stats['entries']))
+    samples.append(('webserver_result_store_bytes', (), store_stats['bytes']))
+
+    cache_stats = result_cache.stats()
+    lookups = cache_stats['hits'] + cache_stats['misses']
+    samples += [
+        ('webserver_result_cache_requests_total', (('result', 'hit'),), cache_stats['hits']),
+        ('webserver_result_cache_requests_total', (('result', 'miss'),), cache_stats['misses']),
+        ('webserver_result_cache_evictions_total', (), cache_stats['evictions']),
+        ('webserver_result_cache_hit_ratio', (),
+         cache_stats['hits'] / lookups if lookups else 0.0),
+        ('webserver_result_cache_bytes', (), cache_stats['bytes']),
+    ]
+    return samples
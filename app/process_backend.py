@@ -0,0 +1,113 @@
+"""" This module contains the ProcessBackend class, a pool of worker
+  processes running the DataIngestor queries outside of the GIL of the
+  server process
+ """
+import copy
+import logging
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import Optional
+
+from app.result_store import encode_result
+
+# state of a worker process: a copy of the ingestor without its frame, whose
+# aggregate index, a few sums per question and state, answers all the queries
+_WORKER_STATE = {}
+# the workers are started by a forkserver, a process without the threads of
+# the server: a fork of the server would copy the locks they hold
+WORKER_CONTEXT = multiprocessing.get_context('forkserver')
+
+
+def _init_worker(data_ingestor):
+    """ keeps the ingestor a worker process answers the queries from """
+    _WORKER_STATE['data_ingestor'] = data_ingestor
+
+
+def _run_query(method_name: str, args: tuple) -> bytes:
+    """ runs a DataIngestor method in a worker, returning its serialized result """
+    method = getattr(_WORKER_STATE['data_ingestor'], method_name)
+    return encode_result(method(*args))
+
+
+class ProcessBackend:
+    """ Runs the DataIngestor queries of the task runners in worker processes """
+
+    def __init__(self, data_ingestor, num_processes: int):
+        self.logger = logging.getLogger('webserver')
+        self.num_processes = num_processes
+        # held while the workers are replaced, by a reload or after one died
+        self._replace_lock = Lock()
+        self._current = (data_ingestor, self._start(data_ingestor))
+
+    def _start(self, data_ingestor) -> ProcessPoolExecutor:
+        """ workers holding a dataset, started as the first queries come; only
+        the aggregate index is pickled to them, the queries never read the frame """
+        shipped = copy.copy(data_ingestor)
+        shipped.df = None
+        workers = ProcessPoolExecutor(self.num_processes, mp_context=WORKER_CONTEXT,
+                                      initializer=_init_worker, initargs=(shipped,))
+        self.logger.info('Started %d worker processes on dataset version %d',
+                         self.num_processes, data_ingestor.version)
+        return workers
+
+    @property
+    def data_ingestor(self):
+        """ the ingestor whose dataset the workers hold """
+        return self._current[0]
+
+    def accepts(self, task_func, kwargs: dict) -> bool:
+        """ whether a task is a query on the dataset the workers hold """
+        return not kwargs and getattr(task_func, '__self__', None) is self.data_ingestor
+
+    def run(self, task_func, args: tuple) -> bytes:
+        """ runs a query in a worker process and waits for its serialized
+        result; raises BrokenProcessPool when a worker died, once the workers
+        are replaced """
+        data_ingestor, workers = self._current
+        if task_func.__self__ is data_ingestor:
+            try:
+                future = self._submit(workers, task_func, args)
+                if future is not None:
+                    return future.result()
+            except BrokenProcessPool:
+                self._replace_broken(workers)
+                raise
+        # the workers hold another version of the dataset
+        return encode_result(task_func(*args))
+
+    @staticmethod
+    def _submit(workers: ProcessPoolExecutor, task_func, args: tuple) -> Optional[Future]:
+        """ future of a query run by workers, None when the workers were
+        retired by a reload after they were picked """
+        try:
+            return workers.submit(_run_query, task_func.__name__, args)
+        except BrokenProcessPool:
+            raise
+        except RuntimeError:
+            return None
+
+    def _replace_broken(self, workers: ProcessPoolExecutor):
+        """ starts new workers in place of a pool in which a worker died; the
+        queries it was running fail, the next ones run on the new workers """
+        with self._replace_lock:
+            data_ingestor, current = self._current
+            if current is workers:
+                self.logger.error('A worker process died, restarting %d worker processes',
+                                  self.num_processes)
+                self._current = (data_ingestor, self._start(data_ingestor))
+        workers.shutdown(wait=False)
+
+    def reload(self, data_ingestor):
+        """ replaces the workers by workers holding a reloaded dataset; the
+        queries already running on the old workers finish first """
+        with self._replace_lock:
+            _, old_workers = self._current
+            self._current = (data_ingestor, self._start(data_ingestor))
+        old_workers.shutdown(wait=True)
+
+    def shutdown(self):
+        """ stops the worker processes """
+        _, workers = self._current
+        workers.shutdown(wait=True)
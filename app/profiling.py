@@ -0,0 +1,151 @@
+"""" This module contains the Profiler class, which profiles a sampled
+  fraction of the jobs and of the requests with cProfile and aggregates
+  the stats per DataIngestor method or endpoint
+ """
+import cProfile
+import marshal
+import os
+import pstats
+import random
+from contextlib import contextmanager
+from threading import Lock
+from typing import Optional
+
+PROFILE_TARGETS = ('jobs', 'requests')
+# deepest call path written to the collapsed stacks
+MAX_STACK_DEPTH = 64
+
+
+def function_label(function: tuple) -> str:
+    """ name of a (file, line, function) key of the pstats """
+    filename, line, name = function
+    if filename == '~':
+        # built-in functions
+        return name
+    return f'{name} ({os.path.basename(filename)}:{line})'
+
+
+def collapsed_stacks(stats: pstats.Stats) -> str:
+    """ call paths of the stats in the collapsed-stack format of the flame
+    graph tools, one 'caller;callee <microseconds>' line per path; cProfile
+    only records caller/callee pairs, so the own time of a function is split
+    between its callers in proportion to the time they spent in it """
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees.setdefault(caller, []).append((function, cumulative))
+    # the functions entered from outside of the profiled calls (cProfile does
+    # not list those callers), with the share of their time spent there
+    roots = []
+    for function, (_, _, _, total_time, callers) in stats.stats.items():
+        inside = sum(entry[3] for caller, entry in callers.items() if caller != function)
+        if not callers or (total_time and total_time - inside > total_time * 1e-6):
+            roots.append((function, 1.0 - inside / total_time if total_time else 1.0))
+
+    lines = {}
+
+    def walk(function, path, share):
+        _, _, own_time, total_time, _ = stats.stats[function]
+        path = path + (function_label(function),)
+        if own_time * share > 0:
+            key = ';'.join(path)
+            lines[key] = lines.get(key, 0) + own_time * share
+        if len(path) >= MAX_STACK_DEPTH or not total_time:
+            return
+        for callee, cumulative in callees.get(function, []):
+            if function_label(callee) not in path:
+                walk(callee, path, share * cumulative / total_time)
+
+    for root, share in roots:
+        walk(root, (), share)
+    return ''.join(f'{path} {round(seconds * 1e6)}\n' for path, seconds in sorted(lines.items()))
+
+
+class Profiler:
+    """ Profiles a `sample_rate` fraction of the jobs and requests of the
+    enabled targets, stats are aggregated per name """
+
+    def __init__(self, targets: tuple = (), sample_rate: float = 0.1):
+        self.targets = set(targets)
+        self.sample_rate = sample_rate
+        # name -> (aggregated pstats.Stats, number of profiled runs)
+        self._stats = {}
+        self._lock = Lock()
+
+    def configure(self, targets, sample_rate: float):
+        """ sets the profiled targets and the sampled fraction """
+        unknown = set(targets) - set(PROFILE_TARGETS)
+        if unknown or not 0 <= sample_rate <= 1:
+            raise ValueError(f'Invalid profiling targets {sorted(unknown)} or rate {sample_rate}')
+        self.targets = set(targets)
+        self.sample_rate = sample_rate
+
+    def start(self, target: str) -> Optional[cProfile.Profile]:
+        """ a started profile when the run is sampled, None otherwise """
+        if target not in self.targets or random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is active on this thread
+            return None
+        return profile
+
+    def finish(self, name: str, profile: Optional[cProfile.Profile]):
+        """ stops a profile and adds it to the stats of `name` """
+        if profile is None:
+            return
+        profile.disable()
+        with self._lock:
+            stats, runs = self._stats.get(name, (None, 0))
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+            self._stats[name] = (stats, runs + 1)
+
+    @contextmanager
+    def profile(self, target: str, name: str):
+        """ profiles the enclosed block when it is sampled """
+        profile = self.start(target)
+        try:
+            yield
+        finally:
+            self.finish(name, profile)
+
+    def summary(self) -> dict:
+        """ settings and number of profiled runs per name """
+        with self._lock:
+            runs = {name: entry[1] for name, entry in self._stats.items()}
+        return {'targets': sorted(self.targets), 'sample_rate': self.sample_rate, 'runs': runs}
+
+    def pstats_bytes(self, name: str) -> Optional[bytes]:
+        """ the stats of `name` in the file format of pstats, None if none were recorded """
+        with self._lock:
+            entry = self._stats.get(name)
+            return marshal.dumps(entry[0].stats) if entry is not None else None
+
+    def collapsed(self, name: str) -> Optional[str]:
+        """ the stats of `name` as collapsed stacks, None if none were recorded """
+        with self._lock:
+            entry = self._stats.get(name)
+            return collapsed_stacks(entry[0]) if entry is not None else None
+
+    def reset(self):
+        """ drops the recorded stats """
+        with self._lock:
+            self._stats.clear()
+
+
+def create_profiler() -> Profiler:
+    """ profiler set by the PROFILE_TARGETS (e.g. 'jobs,requests') and
+    PROFILE_SAMPLE_RATE environment variables """
+    targets = [target for target in os.getenv('PROFILE_TARGETS', '').split(',') if target]
+    profiler = Profiler()
+    profiler.configure(targets, float(os.getenv('PROFILE_SAMPLE_RATE', '0.1')))
+    return profiler
+
+
+# profiler of the webserver process
+PROFILER = create_profiler()
@@ -0,0 +1,97 @@
+"""" This module contains the ResultCache class, a bounded LRU cache
+  memoizing the serialized results of the DataIngestor methods
+ """
+import os
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Optional
+
+
+def query_key(task_func, args: tuple, kwargs: dict) -> Optional[tuple]:
+    """ the (endpoint, question, state) key of a task calling a DataIngestor
+    method, None for any other task """
+    owner = getattr(task_func, '__self__', None)
+    if kwargs or getattr(owner, 'version', None) is None or not 1 <= len(args) <= 2:
+        return None
+    question = args[0]
+    state = args[1] if len(args) == 2 else None
+    if not isinstance(question, str) or not isinstance(state, (str, type(None))):
+        return None
+    return task_func.__name__, question, state
+
+
+class ResultCache:
+    """ LRU cache of endpoint results, bounded by entries and bytes and
+    invalidated when the dataset version changes """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version = None
+        self.size_bytes = 0
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    @classmethod
+    def from_env(cls):
+        """ cache sized by RESULT_CACHE_MAX_ENTRIES and RESULT_CACHE_MAX_BYTES """
+        return cls(int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1024')),
+                   int(os.getenv('RESULT_CACHE_MAX_BYTES', str(64 * 1024 * 1024))))
+
+    def _check_version(self, version) -> bool:
+        """ drops every entry once a newer dataset version is looked up;
+        returns whether the entries are computed on `version` """
+        if self.version is None or version > self.version:
+            if self._entries:
+                self.counters['invalidations'] += 1
+            self._entries.clear()
+            self.size_bytes = 0
+            self.version = version
+        return version == self.version
+
+    def get(self, key: tuple, version) -> tuple[bool, Optional[bytes]]:
+        """ (True, payload) on a hit, (False, None) on a miss """
+        with self._lock:
+            # a job submitted before a reload looks up an older version
+            entry = self._entries.get(key) if self._check_version(version) else None
+            if entry is None:
+                self.counters['misses'] += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return True, entry[0]
+
+    def put(self, key: tuple, version, payload: bytes):
+        """ stores a serialized result, evicting the least recently used entries """
+        size = len(payload)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        with self._lock:
+            if version != self.version:
+                # computed on a dataset that is no longer current
+                return
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= previous[1]
+            self._entries[key] = (payload, size)
+            self.size_bytes += size
+            while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+                self.counters['evictions'] += 1
+
+    def get_or_compute(self, key: tuple, version, compute: Callable[[], bytes]) -> bytes:
+        """ the cached serialized result of a query, computed and stored on a miss """
+        found, payload = self.get(key, version)
+        if not found:
+            payload = compute()
+            self.put(key, version, payload)
+        return payload
+
+    def stats(self) -> dict:
+        """ hit/miss counters and the current size of the cache """
+        with self._lock:
+            return dict(self.counters, entries=len(self._entries),
+                        bytes=self.size_bytes, max_entries=self.max_entries,
+                        max_bytes=self.max_bytes)
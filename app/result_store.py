@@ -0,0 +1,208 @@
+"""" This module contains the stores keeping the results of the jobs
+  until the clients fetch them; results are stored as the JSON bytes
+  produced once when the job finishes
+ """
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Iterator, Optional
+
+# bytes read at a time when a stored result is streamed to a client
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def encode_result(result: Any) -> bytes:
+    """ serializes a job result, the only encoding a result goes through """
+    return json.dumps(result).encode('utf-8')
+
+
+class ResultStore(ABC):
+    """ Interface of the job result stores """
+
+    @abstractmethod
+    def put(self, job_id: str, payload: bytes):
+        """ stores the serialized result of a finished job """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[bytes]:
+        """ the serialized result of a job, None if the store does not hold it """
+
+    def open(self, job_id: str) -> Optional[tuple[int, Iterator[bytes]]]:
+        """ size and chunks of the serialized result of a job, None if the
+        store does not hold it; the chunks are read as they are consumed """
+        payload = self.get(job_id)
+        if payload is None:
+            return None
+        return len(payload), iter((payload,))
+
+    @abstractmethod
+    def __contains__(self, job_id: str) -> bool:
+        """ whether the store holds the result of a job """
+
+    @abstractmethod
+    def job_ids(self) -> list:
+        """ ids of the jobs whose result is stored """
+
+    def stats(self) -> dict:
+        """ number of stored results, and the bytes they take in memory """
+        return {'entries': len(self.job_ids()), 'bytes': 0}
+
+
+class DiskResultStore(ResultStore):
+    """ Keeps every result in a <job_id>.json file """
+
+    def __init__(self, directory: str = 'results'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def put(self, job_id: str, payload: bytes):
+        path = self._path(job_id)
+        # write then rename, so that readers never see a partial file
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+
+    def get(self, job_id: str) -> Optional[bytes]:
+        path = self._path(job_id)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def open(self, job_id: str) -> Optional[tuple[int, Iterator[bytes]]]:
+        try:
+            # pylint: disable-next=consider-using-with
+            f = open(self._path(job_id), 'rb')  # closed by _read_chunks once the body is sent
+        except FileNotFoundError:
+            return None
+        return os.fstat(f.fileno()).st_size, self._read_chunks(f)
+
+    @staticmethod
+    def _read_chunks(f) -> Iterator[bytes]:
+        """ the content of an open file, STREAM_CHUNK_BYTES at a time """
+        with f:
+            while chunk := f.read(STREAM_CHUNK_BYTES):
+                yield chunk
+
+    def delete(self, job_id: str):
+        """ removes the result of a job """
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, job_id: str) -> bool:
+        return os.path.exists(self._path(job_id))
+
+    def job_ids(self) -> list:
+        return [f[:-len('.json')] for f in os.listdir(self.directory) if f.endswith('.json')]
+
+
+# pylint: disable-next=too-many-instance-attributes
+class MemoryResultStore(ResultStore):  # one attribute per RESULT_* setting
+    """ Keeps the results in memory, bounded in bytes and time; results which
+    are large, old or over the memory bound are spilled to disk if a spill
+    directory is set and dropped otherwise """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl: float = 3600,
+                 spill: Optional[DiskResultStore] = None, spill_after: float = 0,
+                 spill_min_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill = spill
+        self.spill_after = spill_after
+        self.spill_min_bytes = spill_min_bytes
+        self.size_bytes = 0
+        # job_id -> (stored_at, payload), oldest first
+        self._entries = OrderedDict()
+        # job_id -> stored_at of the results moved to the spill store, oldest first
+        self._spilled = OrderedDict()
+        self._lock = Lock()
+
+    def put(self, job_id: str, payload: bytes):
+        now = time.monotonic()
+        with self._lock:
+            if (self.spill is not None and self.spill_min_bytes
+                    and len(payload) >= self.spill_min_bytes):
+                self.spill.put(job_id, payload)
+                self._spilled[job_id] = now
+            else:
+                self._entries[job_id] = (now, payload)
+                self.size_bytes += len(payload)
+            self._evict(now)
+
+    def get(self, job_id: str) -> Optional[bytes]:
+        with self._lock:
+            self._evict(time.monotonic())
+            entry = self._entries.get(job_id)
+            if entry is not None:
+                return entry[1]
+            if job_id not in self._spilled:
+                return None
+        return self.spill.get(job_id)
+
+    def open(self, job_id: str) -> Optional[tuple[int, Iterator[bytes]]]:
+        with self._lock:
+            self._evict(time.monotonic())
+            entry = self._entries.get(job_id)
+            if entry is not None:
+                # held whole in memory already, sent as one chunk
+                return len(entry[1]), iter((entry[1],))
+            if job_id not in self._spilled:
+                return None
+        # spilled results are streamed from their file, never read whole
+        return self.spill.open(job_id)
+
+    def __contains__(self, job_id: str) -> bool:
+        with self._lock:
+            self._evict(time.monotonic())
+            return job_id in self._entries or job_id in self._spilled
+
+    def job_ids(self) -> list:
+        with self._lock:
+            self._evict(time.monotonic())
+            return list(self._spilled) + list(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'entries': len(self._spilled) + len(self._entries),
+                    'bytes': self.size_bytes}
+
+    def _evict(self, now: float):
+        """ expires, spills or drops results, oldest first """
+        while self._spilled and self.ttl and now - next(iter(self._spilled.values())) > self.ttl:
+            job_id, _ = self._spilled.popitem(last=False)
+            self.spill.delete(job_id)
+
+        while self._entries:
+            job_id, (stored_at, payload) = next(iter(self._entries.items()))
+            expired = self.ttl and now - stored_at > self.ttl
+            too_old = self.spill_after and now - stored_at > self.spill_after
+            if not (expired or too_old or self.size_bytes > self.max_bytes):
+                break
+            del self._entries[job_id]
+            self.size_bytes -= len(payload)
+            if self.spill is not None and not expired:
+                self.spill.put(job_id, payload)
+                self._spilled[job_id] = stored_at
+
+
+def create_result_store() -> ResultStore:
+    """ result store selected by the RESULT_STORE* environment variables """
+    if os.getenv('RESULT_STORE', 'memory') == 'disk':
+        return DiskResultStore(os.getenv('RESULT_DIR', 'results'))
+    spill_dir = os.getenv('RESULT_SPILL_DIR', 'results')
+    return MemoryResultStore(
+        max_bytes=int(os.getenv('RESULT_STORE_MAX_BYTES', str(256 * 1024 * 1024))),
+        ttl=float(os.getenv('RESULT_TTL', '3600')),
+        spill=DiskResultStore(spill_dir) if spill_dir else None,
+        spill_after=float(os.getenv('RESULT_SPILL_AFTER', '0')),
+        spill_min_bytes=int(os.getenv('RESULT_SPILL_MIN_BYTES', '0')))
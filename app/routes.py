@@ -1,31 +1,162 @@
 """write doc here"""
+import hmac
+import json
 import logging
 import os
-from flask import request, jsonify
+from flask import g, request, jsonify, Response
 from app import webserver
+from app.data_ingestor import COMPACT_COLUMNS, QUERY_ENDPOINTS
+from app.job_queue import PRIORITY_CLASSES, QueueFullError
+from app.job_registry import JOB_STATES
+from app.metrics import METRICS, pool_samples, store_samples
+from app.profiling import PROFILER
 
 logger = logging.getLogger('webserver')
 
+# upper bound of the wait parameter of get_results, in seconds
+MAX_RESULT_WAIT = float(os.getenv('MAX_RESULT_WAIT', '30'))
+# upper bound of the number of queries of a batch
+MAX_BATCH_QUERIES = int(os.getenv('MAX_BATCH_QUERIES', '1000'))
+# seconds a client rejected by a saturated queue is told to wait
+RETRY_AFTER = int(os.getenv('RETRY_AFTER', '1'))
+# upper bound of the number of rows of an ingest request
+MAX_INGEST_ROWS = int(os.getenv('MAX_INGEST_ROWS', '10000'))
+# token required in the X-Admin-Token header of the admin endpoints, if set
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+# default and upper bound of the page size of /api/jobs
+JOBS_PAGE_SIZE = 100
+MAX_JOBS_PAGE_SIZE = 1000
+# priority class of the jobs of each endpoint, a request can choose another
+# one with its 'priority' parameter
+ENDPOINT_PRIORITIES = {
+    'state_mean': 'high',
+    'global_mean': 'high',
+    'state_diff_from_mean': 'high',
+    'states_mean': 'normal',
+    'best5': 'normal',
+    'worst5': 'normal',
+    'diff_from_mean': 'normal',
+    'state_mean_by_category': 'normal',
+    'mean_by_category': 'low',
+    'batch': 'low',
+}
+
 
 def get_next_job_id():
     """this function returns the next job id"""
-    job_id = f"job_id_{webserver.job_counter}"
-    webserver.job_counter += 1
-    return job_id
+    return webserver.job_registry.next_job_id()
+
+
+def client_id() -> str:
+    """identifies the client for the fair queuing of its jobs"""
+    return request.headers.get('X-Client-Id', request.remote_addr)
+
+
+def job_priority(task_func) -> str:
+    """priority class requested for the job, or the one of its endpoint"""
+    data = request.get_json(silent=True)
+    priority = data.get('priority') if isinstance(data, dict) else None
+    if priority in PRIORITY_CLASSES:
+        return priority
+    return ENDPOINT_PRIORITIES.get(task_func.__name__, 'normal')
+
+
+def invalid_parameters_response():
+    """400 answer to a query whose question or state is not a string"""
+    response = jsonify({
+        'status': 'error',
+        'reason': 'Invalid question or state parameter'
+    })
+    response.status_code = 400
+    return response
+
+
+def submit_job(task_func, *args):
+    """enqueues a job and returns its id, or rejects it with a retry hint
+    when the queue is saturated; with ?inline=1 a result which is cached or
+    cheap to compute is returned right away, without a job"""
+    if task_func.__name__ in QUERY_ENDPOINTS and not all(isinstance(arg, str) for arg in args):
+        return invalid_parameters_response()
+    if request.args.get('inline') == '1':
+        version = getattr(getattr(task_func, '__self__', None), 'version', None)
+        payload = webserver.tasks_runner.run_inline(task_func, *args)
+        if payload is not None:
+            return done_response(len(payload), (payload,), version)
+    job_id = get_next_job_id()
+    try:
+        webserver.tasks_runner.add_task(job_id, task_func, *args, client=client_id(),
+                                        priority=job_priority(task_func))
+    except QueueFullError as e:
+        logger.warning('Rejected job %s of client %s: %s', job_id, client_id(), e.reason)
+        response = jsonify({
+            'status': 'error',
+            'reason': 'Server busy, retry later',
+            'retry_after': RETRY_AFTER
+        })
+        response.status_code = 429
+        response.headers['Retry-After'] = str(RETRY_AFTER)
+        return response
+    return jsonify({'job_id': job_id})
+
+
+@webserver.before_request
+def start_request_profile():
+    """profiles the request when profiling of the requests samples it"""
+    g.profile = PROFILER.start('requests')
+
+
+@webserver.teardown_request
+def finish_request_profile(_error):
+    """adds the profile of the request to the stats of its endpoint"""
+    PROFILER.finish(request.endpoint or 'unknown', g.pop('profile', None))
+
+
+@webserver.after_request
+def count_request(response):
+    """counts the requests per endpoint and status code"""
+    METRICS.inc('webserver_requests_total',
+                (('endpoint', request.endpoint or 'unknown'), ('code', response.status_code)))
+    return response
 
 
 @webserver.route('/api/get_results/<job_id>', methods=['GET'])
 def get_response(job_id):
-    """"this function returns the results"""
+    """"this function returns the results, with ?wait=<seconds> it blocks
+    until the job is done or the timeout expires"""
     logger.info('Get results for job_id: %s', job_id)
 
-    if not webserver.tasks_runner.is_job_done(job_id):
+    if webserver.tasks_runner.job_status(job_id) is None:
+        return jsonify({'status': 'error', 'reason': 'Invalid job_id'})
+    wait = min(request.args.get('wait', 0, type=float), MAX_RESULT_WAIT)
+    if wait > 0:
+        webserver.tasks_runner.wait_for_job(job_id, wait)
+    record = webserver.job_registry.get(job_id)
+    if record.status == 'error':
+        return jsonify({'status': 'error', 'reason': record.reason})
+    if record.status != 'done':
         return jsonify({'status': 'running'})
-    result = webserver.tasks_runner.get_job_result(job_id)
+    result = webserver.tasks_runner.open_job_result(job_id)
     if result is None:
-        return jsonify({'status': 'error', 'reason': 'Invalid job_id'})
+        return jsonify({'status': 'error', 'reason': 'Result expired'})
+
+    return done_response(*result, record.version)
+
+
+def done_response(size: int, chunks, version=None) -> Response:
+    """streams a serialized result, `size` bytes in `chunks`, in the done
+    envelope without decoding it, with the dataset version the result was
+    computed on"""
+    head = b'{"status": "done", "data": '
+    tail = b', "version": %s}' % json.dumps(version).encode()
+
+    def envelope():
+        yield head
+        yield from chunks
+        yield tail
 
-    return jsonify({'status': 'done', 'data': result})
+    response = Response(envelope(), mimetype='application/json')
+    response.content_length = len(head) + size + len(tail)
+    return response
 
 
 @webserver.route('/api/states_mean', methods=['POST'])
@@ -40,13 +171,10 @@ def states_mean_request():
             'reason': 'Missing question parameter'
         })
 
-    job_id = get_next_job_id()
-    webserver.tasks_runner.add_task(
-        job_id,
+    return submit_job(
         webserver.data_ingestor.states_mean,
         data['question']
     )
-    return jsonify({'job_id': job_id})
 
 
 @webserver.route('/api/state_mean', methods=['POST'])
@@ -61,16 +189,12 @@ def state_mean_request():
             'reason': 'Missing question or state parameter'
         })
 
-    job_id = get_next_job_id()
-    webserver.tasks_runner.add_task(
-        job_id,
+    return submit_job(
         webserver.data_ingestor.state_mean,
         data['question'],
         data['state']
     )
 
-    return jsonify({'job_id': job_id})
-
 
 @webserver.route('/api/best5', methods=['POST'])
 def best5_request():
@@ -84,13 +208,10 @@ def best5_request():
             'reason': 'Missing question parameter'
         })
 
-    job_id = get_next_job_id()
-    webserver.tasks_runner.add_task(
-        job_id,
+    return submit_job(
         webserver.data_ingestor.best5,
         data['question']
     )
-    return jsonify({'job_id': job_id})
 
 
 @webserver.route('/api/worst5', methods=['POST'])
@@ -105,15 +226,11 @@ def worst5_request():
             'reason': 'Missing question parameter'
         })
 
-    job_id = get_next_job_id()
-    webserver.tasks_runner.add_task(
-        job_id,
+    return submit_job(
         webserver.data_ingestor.worst5,
         data['question']
     )
 
-    return jsonify({'job_id': job_id})
-
 
 @webserver.route('/api/global_mean', methods=['POST'])
 def global_mean_request():
@@ -127,15 +244,11 @@ def global_mean_request():
             'reason': 'Missing question parameter'
         })
 
-    job_id = get_next_job_id()
-    webserver.tasks_runner.add_task(
-        job_id,
+    return submit_job(
         webserver.data_ingestor.global_mean,
         data['question']
     )
 
-    return jsonify({'job_id': job_id})
-
 
 @webserver.route('/api/diff_from_mean', methods=['POST'])
 def diff_from_mean_request():
@@ -149,15 +262,11 @@ def diff_from_mean_request():
             'reason': 'Missing question parameter'
         })
 
-    job_id = get_next_job_id()
-    webserver.tasks_runner.add_task(
-        job_id,
+    return submit_job(
         webserver.data_ingestor.diff_from_mean,
         data['question']
     )
 
-    return jsonify({'job_id': job_id})
-
 
 @webserver.route('/api/state_diff_from_mean', methods=['POST'])
 def state_diff_from_mean_request():
@@ -171,16 +280,12 @@ def state_diff_from_mean_request():
             'reason': 'Missing question or state parameter'
         })
 
-    job_id = get_next_job_id()
-    webserver.tasks_runner.add_task(
-        job_id,
+    return submit_job(
         webserver.data_ingestor.state_diff_from_mean,
         data['question'],
         data['state']
     )
 
-    return jsonify({'job_id': job_id})
-
 
 @webserver.route('/api/mean_by_category', methods=['POST'])
 def mean_by_category_request():
@@ -194,15 +299,11 @@ def mean_by_category_request():
             'reason': 'Missing question parameter'
         })
 
-    job_id = get_next_job_id()
-    webserver.tasks_runner.add_task(
-        job_id,
+    return submit_job(
         webserver.data_ingestor.mean_by_category,
         data['question']
     )
 
-    return jsonify({'job_id': job_id})
-
 
 @webserver.route('/api/state_mean_by_category', methods=['POST'])
 def state_mean_by_category_request():
@@ -216,15 +317,51 @@ def state_mean_by_category_request():
             'reason': 'Missing question or state parameter'
         })
 
-    job_id = get_next_job_id()
-    webserver.tasks_runner.add_task(
-        job_id,
+    return submit_job(
         webserver.data_ingestor.state_mean_by_category,
         data['question'],
         data['state']
     )
 
-    return jsonify({'job_id': job_id})
+
+def is_valid_query(query) -> bool:
+    """checks that a batch query names an endpoint and its parameters"""
+    if not isinstance(query, dict) or not isinstance(query.get('endpoint'), str):
+        return False
+    if query['endpoint'] not in QUERY_ENDPOINTS:
+        return False
+    if 'question' not in query:
+        return False
+    return not QUERY_ENDPOINTS[query['endpoint']] or 'state' in query
+
+
+def has_string_parameters(query: dict) -> bool:
+    """checks that the question and state of a batch query are strings"""
+    names = ('question', 'state') if QUERY_ENDPOINTS[query['endpoint']] else ('question',)
+    return all(isinstance(query[name], str) for name in names)
+
+
+@webserver.route('/api/batch', methods=['POST'])
+def batch_request():
+    """function to request several queries answered by a single job"""
+    data = request.json
+    logger.info('Batch request: %s', data)
+
+    queries = data.get('queries') if isinstance(data, dict) else None
+    if (not isinstance(queries, list) or not 0 < len(queries) <= MAX_BATCH_QUERIES
+            or not all(is_valid_query(query) for query in queries)):
+        return jsonify({
+            'status': 'error',
+            'reason': 'Missing or invalid queries parameter'
+        })
+
+    if not all(has_string_parameters(query) for query in queries):
+        return invalid_parameters_response()
+
+    return submit_job(
+        webserver.data_ingestor.batch,
+        queries
+    )
 
 
 @webserver.route('/api/graceful_shutdown', methods=['GET'])
@@ -241,18 +378,51 @@ def graceful_shutdown():
 
 @webserver.route('/api/jobs', methods=['GET'])
 def jobs():
-    """provides status of all jobs"""
+    """provides a page of the jobs and their status in submission order,
+    ?status= keeps the jobs in one state, ?limit= sets the size of the page,
+    which starts after the submission number ?after= (the `next` of the
+    previous page)"""
     logger.info('Jobs status requested')
 
-    # List all files in results directory
-    job_files = [f for f in os.listdir('results') if f.endswith('.json')]
+    status = request.args.get('status')
+    after = request.args.get('after', '0')
+    limit = request.args.get('limit', JOBS_PAGE_SIZE, type=int)
+    invalid = {
+        'status': 'error',
+        'reason': 'Invalid status, after or limit parameter'
+    }
+    if ((status is not None and status not in JOB_STATES) or not after.isdecimal()
+            or not 0 < limit <= MAX_JOBS_PAGE_SIZE):
+        return jsonify(invalid)
+
+    after = int(after)
+    total, records = webserver.job_registry.list_jobs(status, after, limit)
     job_statuses = [{
-        f.replace('.json', ''): 'done'
-    } for f in job_files]
+        record.job_id: record.status
+    } for record in records]
+
+    return jsonify({
+        'status': 'done',
+        'data': job_statuses,
+        'total': total,
+        'after': after,
+        'limit': limit,
+        'next': records[-1].seq if len(records) == limit else None
+    })
+
+
+@webserver.route('/api/jobs/<job_id>', methods=['GET'])
+def job_info(job_id):
+    """provides the state and the timestamps of a job"""
+    logger.info('Job info requested for job_id: %s', job_id)
+
+    record = webserver.job_registry.get(job_id)
+    if record is None:
+        return jsonify({'status': 'error', 'reason': 'Invalid job_id'})
 
     return jsonify({
         'status': 'done',
-        'data': job_statuses
+        'data': record._asdict()
     })
 
 
@@ -260,7 +430,112 @@ def jobs():
 def num_jobs():
     """provides number of jobs in queue"""
     logger.info('Number of jobs requested')
-    return jsonify({'num_jobs': webserver.tasks_runner.job_queue.qsize()})
+    return jsonify({'num_jobs': webserver.tasks_runner.job_queue.qsize(),
+                    'queue': webserver.tasks_runner.job_queue.stats(),
+                    'jobs': webserver.job_registry.counts()})
+
+
+@webserver.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    """provides the hit/miss counters and size of the result cache"""
+    logger.info('Cache stats requested')
+    return jsonify(webserver.result_cache.stats())
+
+
+@webserver.route('/api/metrics', methods=['GET'])
+def metrics():
+    """provides the metrics of the webserver in the Prometheus text format"""
+    samples = pool_samples(METRICS, webserver.tasks_runner) + store_samples(
+        webserver.job_registry, webserver.result_store, webserver.result_cache)
+    return Response(METRICS.render(samples), mimetype='text/plain; version=0.0.4')
+
+
+def is_admin() -> bool:
+    """checks the admin token of the request; without a configured
+    ADMIN_TOKEN the admin endpoints are refused"""
+    token = request.headers.get('X-Admin-Token')
+    return ADMIN_TOKEN is not None and token is not None \
+        and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+@webserver.route('/api/dataset', methods=['GET'])
+def dataset():
+    """provides the version of the dataset in use and the reload state"""
+    return jsonify({'status': 'done', 'data': webserver.dataset_reloader.status()})
+
+
+@webserver.route('/api/reload', methods=['POST'])
+def reload_dataset():
+    """reloads the csv in the background; the new version is used by the
+    jobs submitted once it is loaded"""
+    if not is_admin():
+        return jsonify({'status': 'error', 'reason': 'Invalid admin token'}), 403
+    logger.info('Dataset reload requested')
+    if not webserver.dataset_reloader.reload_in_background():
+        return jsonify({'status': 'error', 'reason': 'Reload already running'})
+    return jsonify({'status': 'running',
+                    'version': webserver.dataset_reloader.data_ingestor.version})
+
+
+@webserver.route('/api/ingest', methods=['POST'])
+def ingest_rows():
+    """adds survey rows, e.g. {"rows": [{"Question": "...", "LocationDesc":
+    "Ohio", "StratificationCategory1": "Gender", "Stratification1": "Male",
+    "Data_Value": 31.2}]}, to the aggregates of the dataset in use"""
+    if not is_admin():
+        return jsonify({'status': 'error', 'reason': 'Invalid admin token'}), 403
+    data = request.get_json(silent=True)
+    rows = data.get('rows') if isinstance(data, dict) else None
+    logger.info('Ingest request of %s rows', len(rows) if isinstance(rows, list) else None)
+
+    if (not isinstance(rows, list) or not 0 < len(rows) <= MAX_INGEST_ROWS
+            or not all(isinstance(row, dict) and isinstance(row.get('Question'), str)
+                       and set(row) <= set(COMPACT_COLUMNS) for row in rows)):
+        return jsonify({
+            'status': 'error',
+            'reason': 'Missing or invalid rows parameter'
+        })
+
+    version = webserver.dataset_reloader.append(rows)
+    return jsonify({'status': 'done', 'rows': len(rows), 'version': version})
+
+
+@webserver.route('/api/profiling', methods=['GET', 'POST'])
+def profiling():
+    """provides the profiling settings and the profiled runs per name; a POST
+    with {"targets": ["jobs", "requests"], "sample_rate": 0.1} changes them,
+    with {"reset": true} it also drops the recorded stats"""
+    if not is_admin():
+        return jsonify({'status': 'error', 'reason': 'Invalid admin token'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        logger.info('Profiling settings: %s', data)
+        try:
+            PROFILER.configure(data.get('targets', PROFILER.targets),
+                               float(data.get('sample_rate', PROFILER.sample_rate)))
+        except (TypeError, ValueError) as e:
+            return jsonify({'status': 'error', 'reason': str(e)})
+        if data.get('reset'):
+            PROFILER.reset()
+    return jsonify({'status': 'done', 'data': PROFILER.summary()})
+
+
+@webserver.route('/api/profiling/<name>', methods=['GET'])
+def profiling_stats(name):
+    """downloads the stats of a DataIngestor method or an endpoint, as a
+    pstats file or, with ?format=collapsed, as collapsed stacks"""
+    if not is_admin():
+        return jsonify({'status': 'error', 'reason': 'Invalid admin token'}), 403
+    if request.args.get('format') == 'collapsed':
+        collapsed = PROFILER.collapsed(name)
+        if collapsed is not None:
+            return Response(collapsed, mimetype='text/plain')
+    else:
+        data = PROFILER.pstats_bytes(name)
+        if data is not None:
+            return Response(data, mimetype='application/octet-stream', headers={
+                'Content-Disposition': f'attachment; filename={name}.pstats'})
+    return jsonify({'status': 'error', 'reason': 'No profile recorded for ' + name})
 
 
 # You can check localhost in your browser to see what this displays
@@ -0,0 +1,170 @@
+"""" This module contains the job registry and the result store kept in a
+  SQLite database in WAL mode, shared by every server process started on
+  the same database file: job ids are unique across the processes and any
+  process can answer for any job
+ """
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Optional
+
+from app.job_registry import JOB_STATES, JobRecord, JobRegistry, create_job_registry
+from app.result_store import ResultStore, create_result_store
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+    "INSERT OR IGNORE INTO counters VALUES ('job_id', 0)",
+    'CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, endpoint TEXT, '
+    'status TEXT NOT NULL, submitted_at REAL, started_at REAL, finished_at REAL, reason TEXT, '
+    'version INTEGER)',
+    'CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)',
+    'CREATE TABLE IF NOT EXISTS results (job_id TEXT PRIMARY KEY, payload BLOB NOT NULL)',
+)
+# the rowid of a job is its submission sequence number
+JOB_COLUMNS = ('job_id, endpoint, status, submitted_at, started_at, finished_at, reason, '
+               'version, rowid')
+
+
+class JobDatabase:
+    """ SQLite database holding the jobs and their results, with one
+    connection per thread of each process """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self._local = threading.local()
+        # connections inherited through a fork; SQLite connections must not
+        # be used, nor closed, by another process than the one opening them
+        self._inherited = []
+        with closing(sqlite3.connect(self.path, timeout=30, isolation_level=None)) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    def connection(self) -> sqlite3.Connection:
+        """ the connection of the calling thread, in autocommit mode, opened
+        by the calling process """
+        connection, pid = getattr(self._local, 'connection', (None, None))
+        if pid != os.getpid():
+            if connection is not None:
+                self._inherited.append(connection)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            # WAL keeps the database consistent with one sync per checkpoint
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = (connection, os.getpid())
+        return connection
+
+    def execute(self, statement: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        """ runs a statement on the connection of the calling thread """
+        return self.connection().execute(statement, parameters)
+
+
+class SharedJobRegistry(JobRegistry):
+    """ Job registry kept in a JobDatabase, keeping the last `max_jobs` jobs;
+    jobs are listed in submission order """
+
+    def __init__(self, database: JobDatabase, max_jobs: int = 1000000):
+        self.database = database
+        self.max_jobs = max_jobs
+
+    def next_job_id(self) -> str:
+        (number,), = self.database.execute(
+            "UPDATE counters SET value = value + 1 WHERE name = 'job_id' RETURNING value"
+        ).fetchall()
+        return f'job_id_{number}'
+
+    def queued(self, job_id: str, endpoint: str, version: Optional[int] = None):
+        cursor = self.database.execute(
+            "INSERT OR REPLACE INTO jobs (job_id, endpoint, status, submitted_at, version) "
+            "VALUES (?, ?, 'queued', ?, ?)", (job_id, endpoint, time.time(), version))
+        self.database.execute('DELETE FROM jobs WHERE rowid <= ?',
+                              (cursor.lastrowid - self.max_jobs,))
+
+    def running(self, job_id: str):
+        self.database.execute(
+            "UPDATE jobs SET status = 'running', started_at = ? WHERE job_id = ?",
+            (time.time(), job_id))
+
+    def done(self, job_id: str):
+        self.database.execute(
+            "UPDATE jobs SET status = 'done', finished_at = ? WHERE job_id = ?",
+            (time.time(), job_id))
+
+    def failed(self, job_id: str, reason: str):
+        self.database.execute(
+            "UPDATE jobs SET status = 'error', finished_at = ?, reason = ? WHERE job_id = ?",
+            (time.time(), reason, job_id))
+
+    def discard(self, job_id: str):
+        self.database.execute('DELETE FROM jobs WHERE job_id = ?', (job_id,))
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        row = self.database.execute(
+            f'SELECT {JOB_COLUMNS} FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        return JobRecord(*row) if row is not None else None
+
+    def list_jobs(self, status: Optional[str] = None, after: int = 0,
+                  limit: int = 100) -> tuple[int, list]:
+        where, parameters = ('status = ? AND', (status,)) if status is not None else ('', ())
+        connection = self.database.connection()
+        # one read transaction, so that the total and the page agree
+        connection.execute('BEGIN')
+        try:
+            (total,), = connection.execute(
+                f'SELECT COUNT(*) FROM jobs WHERE {where} 1', parameters).fetchall()
+            rows = connection.execute(
+                f'SELECT {JOB_COLUMNS} FROM jobs WHERE {where} rowid > ? ORDER BY rowid LIMIT ?',
+                parameters + (after, limit)).fetchall()
+        finally:
+            connection.execute('COMMIT')
+        return total, [JobRecord(*row) for row in rows]
+
+    def counts(self) -> dict:
+        counts = dict.fromkeys(JOB_STATES, 0)
+        counts.update(self.database.execute(
+            'SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+        return counts
+
+
+class SharedResultStore(ResultStore):
+    """ Result store kept in a JobDatabase, keeping the last `max_results`
+    results """
+
+    def __init__(self, database: JobDatabase, max_results: int = 1000000):
+        self.database = database
+        self.max_results = max_results
+
+    def put(self, job_id: str, payload: bytes):
+        cursor = self.database.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?)', (job_id, payload))
+        self.database.execute('DELETE FROM results WHERE rowid <= ?',
+                              (cursor.lastrowid - self.max_results,))
+
+    def get(self, job_id: str) -> Optional[bytes]:
+        row = self.database.execute(
+            'SELECT payload FROM results WHERE job_id = ?', (job_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def __contains__(self, job_id: str) -> bool:
+        return self.database.execute(
+            'SELECT 1 FROM results WHERE job_id = ?', (job_id,)).fetchone() is not None
+
+    def job_ids(self) -> list:
+        rows = self.database.execute('SELECT job_id FROM results ORDER BY rowid')
+        return [row[0] for row in rows]
+
+    def stats(self) -> dict:
+        (entries,), = self.database.execute('SELECT COUNT(*) FROM results').fetchall()
+        return {'entries': entries, 'bytes': 0}
+
+
+def create_job_stores() -> tuple[JobRegistry, ResultStore]:
+    """ job registry and result store; with JOB_STORE=sqlite both are kept
+    in the JOB_DB database shared by the server processes, otherwise they
+    are private to this process """
+    if os.getenv('JOB_STORE', 'memory') != 'sqlite':
+        return create_job_registry(), create_result_store()
+    database = JobDatabase(os.getenv('JOB_DB', 'jobs.db'))
+    history = int(os.getenv('JOB_HISTORY', '1000000'))
+    return SharedJobRegistry(database, history), SharedResultStore(database, history)
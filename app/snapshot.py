@@ -0,0 +1,114 @@
+"""" This module contains the binary snapshot of the compact dataset,
+  written next to the csv file so that later boots memory-map the typed
+  columns instead of parsing the text again
+ """
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b'DISNAP01'
+SNAPSHOT_SUFFIX = '.snapshot'
+# offsets of the column arrays are aligned to a cache line
+ALIGNMENT = 64
+
+logger = logging.getLogger('webserver')
+
+
+def snapshot_path(csv_path: str) -> str:
+    """ the path of the snapshot of a csv file """
+    return csv_path + SNAPSHOT_SUFFIX
+
+
+def fingerprint(csv_path: str) -> dict:
+    """ size, modification time and hash identifying a version of the csv file """
+    stat = os.stat(csv_path)
+    with open(csv_path, 'rb') as f:
+        digest = hashlib.file_digest(f, 'sha256').hexdigest()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _column_arrays(df: pd.DataFrame):
+    """ the raw array and the header entry of every column """
+    for name in df.columns:
+        column = df[name]
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            array = np.ascontiguousarray(column.cat.codes.to_numpy())
+            entry = {'categories': column.cat.categories.tolist()}
+        else:
+            array = np.ascontiguousarray(column.to_numpy())
+            entry = {}
+        entry.update({'name': name, 'dtype': array.dtype.str, 'length': len(array)})
+        yield array, entry
+
+
+def write_snapshot(df: pd.DataFrame, path: str, source: dict):
+    """ writes the columns of the frame into a snapshot file, atomically """
+    columns = list(_column_arrays(df))
+    # offsets are relative to the start of the data section, which follows
+    # the header at the next aligned position
+    offset = 0
+    for array, entry in columns:
+        entry['offset'] = offset
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({'source': source,
+                         'columns': [entry for _, entry in columns]}).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            for array, entry in columns:
+                f.seek(data_start + entry['offset'])
+                f.write(array.tobytes())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_snapshot(path: str, source: dict) -> Optional[pd.DataFrame]:
+    """ maps a snapshot file into a frame, None if it is missing or stale """
+    try:
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                logger.warning("Ignoring snapshot %s with an unknown format", path)
+                return None
+            (header_length,) = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_length))
+            data_start = _aligned(len(MAGIC) + 8 + header_length)
+            if header['source'] != source:
+                logger.info("Snapshot %s is stale", path)
+                return None
+            # read-only shared mapping: every process mapping the file uses
+            # the same page cache pages
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        logger.warning("Ignoring unreadable snapshot %s: %s", path, str(e))
+        return None
+
+    columns = {}
+    for entry in header['columns']:
+        array = np.frombuffer(buffer, dtype=np.dtype(entry['dtype']),
+                              count=entry['length'],
+                              offset=data_start + entry['offset'])
+        if 'categories' in entry:
+            columns[entry['name']] = pd.Categorical.from_codes(array, entry['categories'])
+        else:
+            columns[entry['name']] = pd.Series(array, copy=False)
+    return pd.DataFrame(columns, copy=False)
@@ -1,99 +1,273 @@
 """ Thread pool implementation """
+import asyncio
 import os
-import json
-from queue import Queue, Empty
+import time
+from queue import Empty
 from threading import Thread, Event
 import multiprocessing
 import logging
-from typing import Optional, Any
+from typing import Iterator, Optional
 
+from app.inflight import InFlightJobs
+from app.job_queue import JobQueue, QueueFullError
+from app.job_registry import JobRegistry, MemoryJobRegistry
+from app.metrics import METRICS
+from app.process_backend import ProcessBackend
+from app.profiling import PROFILER
+from app.result_cache import ResultCache, query_key
+from app.result_store import ResultStore, create_result_store, encode_result
 
-class ThreadPool:
+# identical queries queued or running at the same time share one computation
+COALESCE_JOBS = os.getenv('TP_COALESCE', '1') != '0'
+# seconds between two checks of a job run by another server process
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '0.05'))
+# queries estimated to compute faster than this are answered by run_inline
+INLINE_MAX_SECONDS = float(os.getenv('INLINE_MAX_SECONDS', '0.005'))
+# weight of the last computation in the estimated cost of a method
+COST_SMOOTHING = 0.2
+
+
+# pylint: disable-next=too-many-instance-attributes
+class ThreadPool:  # the pool owns the stores, queue and backend its runners share
     """ Thread pool implementation """
 
-    def __init__(self):
+    def __init__(self, result_cache: Optional[ResultCache] = None,
+                 result_store: Optional[ResultStore] = None, data_ingestor=None,
+                 job_registry: Optional[JobRegistry] = None):
         self.logger = logging.getLogger('webserver')
-        self.job_queue = Queue()
+        self.job_queue = JobQueue(int(os.getenv('TP_MAX_QUEUE_DEPTH', '10000')),
+                                  int(os.getenv('TP_MAX_CLIENT_DEPTH', '0')),
+                                  float(os.getenv('TP_PRIORITY_AGING', '1.0')))
+        self.result_cache = result_cache
+        self.result_store = result_store if result_store is not None else create_result_store()
+        self.job_registry = job_registry if job_registry is not None else MemoryJobRegistry()
         self.shutdown_event = Event()
+        self.inflight = InFlightJobs()
+        # DataIngestor method -> moving average of its compute time, in seconds
+        self.costs = {}
         self.num_threads = int(os.getenv('TP_NUM_OF_THREADS', multiprocessing.cpu_count()))
-        self.runners = [
-            TaskRunner(self.job_queue, self.shutdown_event)
-            for _ in range(self.num_threads)
-        ]
-
-        # Ensure results directory exists
-        os.makedirs('results', exist_ok=True)
+        # with TP_BACKEND=process the runners hand the queries to worker processes
+        self.process_backend = None
+        if os.getenv('TP_BACKEND', 'thread') == 'process' and data_ingestor is not None:
+            self.process_backend = ProcessBackend(
+                data_ingestor,
+                int(os.getenv('TP_NUM_OF_PROCESSES', multiprocessing.cpu_count())))
+        self.runners = [TaskRunner(self, f'task-runner-{i}') for i in range(self.num_threads)]
 
         for runner in self.runners:
             runner.start()
 
-    def add_task(self, job_id: str, task_func, *args, **kwargs):
-        """ Add a task to the queue """
-        self.job_queue.put((job_id, task_func, args, kwargs))
+    def add_task(self, job_id: str, task_func, *args, client=None, priority='normal',
+                 **kwargs):
+        """ Add a task to the queue of its priority class, unless an identical
+        query is already queued or running, in which case the job shares its
+        result; raises QueueFullError when the queue rejects the job """
+        key = self.coalescing_key(task_func, args, kwargs)
+        self.job_registry.queued(job_id, task_func.__name__,
+                                 getattr(getattr(task_func, '__self__', None), 'version', None))
+        if not self.inflight.add(job_id, key):
+            return
+        try:
+            self.job_queue.put((job_id, task_func, args, kwargs, time.monotonic()),
+                               client, priority)
+        except QueueFullError:
+            # the rejected job is not kept, its client receives no job id;
+            # the identical jobs which were attached to it meanwhile fail
+            for attached_job_id in self.inflight.finish(job_id, key):
+                if attached_job_id == job_id:
+                    self.job_registry.discard(job_id)
+                else:
+                    self.job_registry.failed(attached_job_id, 'Server busy')
+                self.inflight.notify_done(attached_job_id)
+            raise
+
+    def run_inline(self, task_func, *args) -> Optional[bytes]:
+        """ Serialized result of a query answered without a job: found in the
+        result cache, or computed in the calling thread when the estimated
+        cost of its method is under INLINE_MAX_SECONDS; None when the query
+        has to go through the queue """
+        key = query_key(task_func, args, {})
+        if key is None:
+            return None
+        name = task_func.__name__
+        version = task_func.__self__.version
+        if self.result_cache is not None:
+            found, payload = self.result_cache.get(key, version)
+            if found:
+                METRICS.inc('webserver_inline_results_total',
+                            (('method', name), ('source', 'cache')))
+                return payload
+        if self.costs.get(name, float('inf')) > INLINE_MAX_SECONDS:
+            return None
+        started_at = time.monotonic()
+        try:
+            payload = encode_result(task_func(*args))
+        # pylint: disable-next=broad-exception-caught
+        except Exception:  # whatever the query raised, the job runs it again and reports it
+            return None
+        self.record_cost(name, time.monotonic() - started_at)
+        if self.result_cache is not None:
+            self.result_cache.put(key, version, payload)
+        METRICS.inc('webserver_inline_results_total',
+                    (('method', name), ('source', 'computed')))
+        return payload
+
+    def record_cost(self, name: str, seconds: float):
+        """ Updates the estimated compute time of a method """
+        previous = self.costs.get(name)
+        self.costs[name] = seconds if previous is None else \
+            previous + COST_SMOOTHING * (seconds - previous)
+
+    @staticmethod
+    def coalescing_key(task_func, args, kwargs):
+        """ Key of the tasks computing the same query on the same dataset,
+        None for the tasks which are never coalesced """
+        key = query_key(task_func, args, kwargs) if COALESCE_JOBS else None
+        if key is None:
+            return None
+        return (task_func.__self__, task_func.__self__.version) + key
+
+    def wait_for_job(self, job_id: str, timeout: float) -> bool:
+        """ Block until a job finishes or the timeout expires,
+        returns whether the job is done """
+        deadline = time.monotonic() + timeout
+        if not self.inflight.wait(job_id, timeout):
+            # the job is finished, or it runs in another server process
+            # sharing the job registry: there is no event to wait on
+            while not self.is_job_done(job_id) and time.monotonic() < deadline:
+                time.sleep(JOB_POLL_INTERVAL)
+        return self.is_job_done(job_id)
+
+    async def job_done(self, job_id: str, timeout: float) -> bool:
+        """ Awaitable version of wait_for_job: the job wakes up the event
+        loop when it finishes, so the waiting client holds no thread """
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def wake():
+            try:
+                loop.call_soon_threadsafe(lambda: done.done() or done.set_result(True))
+            except RuntimeError:
+                # the loop was closed while the job ran
+                pass
+
+        if self.inflight.add_done_callback(job_id, wake):
+            try:
+                await asyncio.wait_for(done, timeout)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            deadline = loop.time() + timeout
+            while self.job_status(job_id) in ('queued', 'running') and loop.time() < deadline:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+        return self.is_job_done(job_id)
+
+    def job_status(self, job_id: str) -> Optional[str]:
+        """ State of a job, None for an unknown job """
+        record = self.job_registry.get(job_id)
+        return record.status if record is not None else None
 
     def graceful_shutdown(self):
         """Gracefully shutdown the thread pool"""
         self.shutdown_event.set()
         for runner in self.runners:
             runner.join()
+        if self.process_backend is not None:
+            self.process_backend.shutdown()
 
     def is_job_done(self, job_id: str) -> bool:
-        """ Check if a job is done """
-        return (os.path.exists(f'results/{job_id}.json') and
-                os.path.getsize(f'results/{job_id}.json') > 0)
+        """ Check if a job is finished, with a result or an error """
+        return self.job_status(job_id) in ('done', 'error')
 
-    def get_job_result(self, job_id: str) -> Optional[Any]:
-        """ Get the result of a completed job """
-        file_path = f'results/{job_id}.json'
-        try:
-            if not os.path.exists(file_path):
-                self.logger.error('File %s does not exist', file_path)
-            if os.path.getsize(file_path) == 0:
-                self.logger.error("Job result file is empty: %s", file_path)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except json.JSONDecodeError as e:
-            self.logger.error("Failed to decode JSON from file %s: %s",
-                              file_path, str(e))
-            return None
+    def get_job_result(self, job_id: str) -> Optional[bytes]:
+        """ Get the serialized result of a completed job """
+        return self.result_store.get(job_id)
+
+    def open_job_result(self, job_id: str) -> Optional[tuple[int, Iterator[bytes]]]:
+        """ Size and chunks of the serialized result of a completed job """
+        return self.result_store.open(job_id)
 
 
 class TaskRunner(Thread):
     """ Task runner thread """
 
-    def __init__(self, job_queue: Queue, shutdown_event: Event):
-        super().__init__(daemon=True)
-        self.job_queue = job_queue
-        self.shutdown_event = shutdown_event
+    def __init__(self, pool: ThreadPool, name: Optional[str] = None):
+        super().__init__(name=name, daemon=True)
+        self.pool = pool
+        self.job_queue = pool.job_queue
+        self.shutdown_event = pool.shutdown_event
+        self.result_cache = pool.result_cache
+        self.result_store = pool.result_store
+        self.job_registry = pool.job_registry
         self.logger = logging.getLogger('webserver')
 
     def run(self):
         while not self.shutdown_event.is_set():
             try:
-                job_id, task_func, args, kwargs = self.job_queue.get(timeout=1)
+                job_id, task_func, args, kwargs, enqueued_at = self.job_queue.get(timeout=1)
+                started_at = time.monotonic()
+                method = (('method', task_func.__name__),)
+                METRICS.observe('webserver_job_queue_wait_seconds', method,
+                                started_at - enqueued_at)
                 self._process_job(job_id, task_func, args, kwargs)
+                elapsed = time.monotonic() - started_at
+                METRICS.observe('webserver_job_execution_seconds', method, elapsed)
+                METRICS.inc('webserver_worker_busy_seconds_total', (('worker', self.name),),
+                            elapsed)
             except Empty:
                 continue
-            except (KeyError, TypeError, ValueError) as e:
+            # pylint: disable-next=broad-exception-caught
+            except Exception as e:  # a runner lives as long as the pool, whatever a job raised
                 self.logger.error('Runner error: %s: %s', type(e).__name__, str(e))
 
     def _process_job(self, job_id: str, task_func, args, kwargs):
-        """Process an individual job with error handling"""
+        """Process an individual job with error handling; the result is
+        shared with the identical jobs coalesced into it"""
+        payload, error = None, 'Job failed'
         try:
             self.logger.info('Starting job %s', job_id)
-            result = task_func(*args, **kwargs)
-
-            with open(f'results/{job_id}.json', 'w', encoding='utf-8') as f:
-                json.dump(result, f)
-
+            self.job_registry.running(job_id)
+            with PROFILER.profile('jobs', task_func.__name__):
+                payload = self._run(task_func, args, kwargs)
             self.logger.info('Completed job %s', job_id)
         except FileNotFoundError as e:
             self.logger.error('File not found error in job %s: %s', job_id, str(e))
-            with open(f'results/{job_id}.json', 'w', encoding='utf-8') as f:
-                json.dump({'status': 'error', 'reason': 'File not found error: ' + str(e)}, f)
+            error = 'File not found error: ' + str(e)
         except OSError as e:
             self.logger.error('OS error in job %s: %s', job_id, str(e))
-            with open(f'results/{job_id}.json', 'w', encoding='utf-8') as f:
-                json.dump({'status': 'error', 'reason': 'OS error: ' + str(e)}, f)
+            error = 'OS error: ' + str(e)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as e:  # any other failure of a query fails its job only
+            self.logger.error('Error in job %s: %s: %s', job_id, type(e).__name__, str(e))
+            error = f'{type(e).__name__}: {e}'
         finally:
+            job_ids = self.pool.inflight.finish(
+                job_id, self.pool.coalescing_key(task_func, args, kwargs))
+            for finished_job_id in job_ids:
+                if payload is not None:
+                    self.result_store.put(finished_job_id, payload)
+                    self.job_registry.done(finished_job_id)
+                else:
+                    self.job_registry.failed(finished_job_id, error)
+                self.pool.inflight.notify_done(finished_job_id)
             self.job_queue.task_done()
+
+    def _run(self, task_func, args, kwargs) -> bytes:
+        """Serialized result of a task, looked up in the result cache first"""
+        key = query_key(task_func, args, kwargs) if self.result_cache is not None else None
+        if key is None:
+            return self._compute(task_func, args, kwargs)
+        return self.result_cache.get_or_compute(
+            key, task_func.__self__.version,
+            lambda: self._compute(task_func, args, kwargs))
+
+    def _compute(self, task_func, args, kwargs) -> bytes:
+        """Run a task in a worker process when possible, in this thread otherwise"""
+        started_at = time.monotonic()
+        backend = self.pool.process_backend
+        if backend is not None and backend.accepts(task_func, kwargs):
+            payload = backend.run(task_func, args)
+        else:
+            payload = encode_result(task_func(*args, **kwargs))
+        self.pool.record_cost(task_func.__name__, time.monotonic() - started_at)
+        return payload
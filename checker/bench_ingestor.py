@@ -0,0 +1,169 @@
+"""Microbenchmarks of DataIngestor across dataset sizes: generates datasets of
+several multiples of the source extract, then times the load of each one and
+every query method, and measures their peak memory; the streamed load
+(DATA_CHUNK_ROWS) is measured next to the full one.
+
+    python checker/bench_ingestor.py --scales 1,10,100 --output ingestor.json
+"""
+import argparse
+import functools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from app.aggregate_index import AggregateIndex
+from app.data_ingestor import DataIngestor, QUERY_ENDPOINTS
+from generate_dataset import DEFAULT_SOURCE, generate
+
+
+def timed(func):
+    """seconds taken by a call"""
+    started_at = time.perf_counter()
+    func()
+    return time.perf_counter() - started_at
+
+
+def peak_memory(func):
+    """peak bytes allocated during a call; tracked separately from the timings,
+    as tracing the allocations slows the call down"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def with_env(name, value, func):
+    """runs a call with an environment variable set"""
+    previous = os.environ.get(name)
+    os.environ[name] = value
+    try:
+        return func()
+    finally:
+        if previous is None:
+            del os.environ[name]
+        else:
+            os.environ[name] = previous
+
+
+def bench_load(path, chunk_rows):
+    """timings and peak memory of the load steps of a dataset"""
+    results = {}
+    # parse of the csv, without the snapshot
+    ingestor = with_env('DATA_SNAPSHOT', '0', lambda: DataIngestor(path))
+    results['read_file'] = {
+        'cold': with_env('DATA_SNAPSHOT', '0', lambda: timed(ingestor.read_file)),
+        'peak_bytes': with_env('DATA_SNAPSHOT', '0', lambda: peak_memory(ingestor.read_file)),
+    }
+    results['build_index'] = {
+        'cold': timed(lambda: AggregateIndex.from_frame(ingestor.df)),
+        'peak_bytes': peak_memory(lambda: AggregateIndex.from_frame(ingestor.df)),
+    }
+    # chunked parse folded into the aggregates, without the frame
+    results['stream_index'] = {
+        'cold': timed(lambda: AggregateIndex.from_chunks(ingestor.read_chunks(chunk_rows))),
+        'peak_bytes': peak_memory(
+            lambda: AggregateIndex.from_chunks(ingestor.read_chunks(chunk_rows))),
+    }
+    # the first load writes the snapshot, the next ones map it
+    DataIngestor(path)
+    results['read_snapshot'] = {
+        'cold': timed(ingestor.read_file),
+        'peak_bytes': peak_memory(ingestor.read_file),
+    }
+    return results
+
+
+def query_args(ingestor, endpoint, question):
+    """arguments of a query of an endpoint on a question"""
+    if not QUERY_ENDPOINTS[endpoint]:
+        return (question,)
+    states = ingestor.index.get(question).state_means().dropna()
+    return (question, states.index[0] if len(states) else 'Ohio')
+
+
+def bench_queries(ingestor, repeat):
+    """timings and peak memory of every query method: `cold` is the mean of
+    the first call on each question, `warm` the median of repeated calls"""
+    questions = list(ingestor.index.questions)
+    results = {}
+    for endpoint in QUERY_ENDPOINTS:
+        method = getattr(ingestor, endpoint)
+        arguments = [query_args(ingestor, endpoint, question) for question in questions]
+        # a new index drops the per-question results cached so far
+        ingestor.index = AggregateIndex.from_frame(ingestor.df)
+        cold = [timed(functools.partial(method, *args)) for args in arguments]
+        first = functools.partial(method, *arguments[0])
+        warm = [timed(first) for _ in range(repeat)]
+        ingestor.index = AggregateIndex.from_frame(ingestor.df)
+        results[endpoint] = {
+            'cold': statistics.mean(cold),
+            'warm': statistics.median(warm),
+            'peak_bytes': peak_memory(first),
+        }
+    return results
+
+
+def print_report(runs):
+    """prints the results as a table, times in milliseconds"""
+    print(f'{"scale":>7}{"rows":>11}  {"operation":<24}{"cold ms":>10}{"warm ms":>10}'
+          f'{"peak MiB":>10}')
+    for run in runs:
+        for operation, result in run['operations'].items():
+            warm = f'{result["warm"] * 1000:10.2f}' if 'warm' in result else f'{"-":>10}'
+            print(f'{run["scale"]:>7g}{run["rows"]:>11}  {operation:<24}'
+                  f'{result["cold"] * 1000:10.2f}{warm}'
+                  f'{result["peak_bytes"] / 2 ** 20:10.1f}')
+
+
+def parse_args():
+    """command line options"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='extract to resample')
+    parser.add_argument('--scales', default='1,10,100',
+                        help='dataset sizes, in multiples of the source')
+    parser.add_argument('--data-dir', help='where the datasets are generated and kept '
+                                           '(default: a temporary directory)')
+    parser.add_argument('--chunk-rows', type=int, default=100000,
+                        help='rows per chunk of the streamed load')
+    parser.add_argument('--repeat', type=int, default=20, help='calls of the warm timings')
+    parser.add_argument('--output', help='file the results are written to, as JSON')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(args.source, 'rb') as fin:
+        source_rows = sum(1 for _ in fin) - 1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        runs = []
+        for scale in (float(scale) for scale in args.scales.split(',')):
+            rows = round(source_rows * scale)
+            path = os.path.join(data_dir, f'dataset_x{scale:g}.csv')
+            if not os.path.exists(path):
+                generate(args.source, path, rows)
+            operations = bench_load(path, args.chunk_rows)
+            operations.update(bench_queries(DataIngestor(path), args.repeat))
+            runs.append({'scale': scale, 'rows': rows, 'operations': operations})
+            print(f'Measured scale {scale:g} ({rows} rows)', file=sys.stderr)
+    print_report(runs)
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(runs, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
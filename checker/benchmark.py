@@ -0,0 +1,259 @@
+"""Load test of the webserver: replays the requests of tests/*/input from
+concurrent clients and reports the throughput and the submit-to-result
+latency percentiles per endpoint.
+
+    python checker/benchmark.py --concurrency 16 --duration 30 --output run.json
+    python checker/benchmark.py --mix best5=3,state_mean=1 --compare run.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+# relative increase of a latency percentile, or decrease of the throughput,
+# reported as a regression by --compare
+DEFAULT_THRESHOLD = 0.1
+
+
+def load_fixtures(tests_dir):
+    """endpoint -> request bodies of tests/<endpoint>/input"""
+    fixtures = {}
+    for endpoint in sorted(os.listdir(tests_dir)):
+        input_dir = os.path.join(tests_dir, endpoint, 'input')
+        if not os.path.isdir(input_dir):
+            continue
+        fixtures[endpoint] = []
+        for input_file in sorted(os.listdir(input_dir)):
+            with open(os.path.join(input_dir, input_file), 'r') as fin:
+                fixtures[endpoint].append(json.load(fin))
+    return fixtures
+
+
+def parse_mix(mix, endpoints):
+    """endpoint -> weight of a 'best5=3,state_mean=1' mix, every endpoint
+    with weight 1 when the mix is empty"""
+    if not mix:
+        return {endpoint: 1.0 for endpoint in endpoints}
+    weights = {}
+    for item in mix.split(','):
+        endpoint, _, weight = item.partition('=')
+        endpoint = endpoint.strip()
+        if endpoint not in endpoints:
+            sys.exit(f'Unknown endpoint in the mix: {endpoint}')
+        weights[endpoint] = float(weight) if weight else 1.0
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    """nearest-rank percentile of sorted values"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Client(threading.Thread):
+    """Sends one request at a time until the benchmark ends, and waits for
+    its result before sending the next one"""
+
+    def __init__(self, bench, seed):
+        super().__init__(daemon=True)
+        self.bench = bench
+        self.random = random.Random(seed)
+        self.session = requests.Session()
+        # (endpoint, outcome, latency in seconds) of the sent requests
+        self.samples = []
+
+    def run(self):
+        bench = self.bench
+        while bench.take_request():
+            endpoint = self.random.choices(bench.endpoints, bench.weights)[0]
+            body = self.random.choice(bench.fixtures[endpoint])
+            started_at = time.perf_counter()
+            try:
+                outcome = self.request(endpoint, body)
+            except requests.RequestException:
+                outcome = 'connection_error'
+            self.samples.append((endpoint, outcome, time.perf_counter() - started_at))
+
+    def request(self, endpoint, body):
+        """submits a job and polls its result, returns the outcome"""
+        args = self.bench.args
+        response = self.session.post(f'{args.url}/api/{endpoint}', json=body)
+        if response.status_code == 429:
+            return 'rejected'
+        job_id = response.json().get('job_id')
+        if job_id is None:
+            return 'error'
+
+        deadline = time.perf_counter() + args.timeout
+        while time.perf_counter() < deadline:
+            url = f'{args.url}/api/get_results/{job_id}'
+            if args.wait:
+                url += f'?wait={args.wait}'
+            status = self.session.get(url).json()['status']
+            if status != 'running':
+                return 'done' if status == 'done' else 'error'
+            if not args.wait:
+                time.sleep(args.poll_interval)
+        return 'timeout'
+
+
+class Benchmark:
+    """Shared state of the clients: the request mix and the stop condition"""
+
+    def __init__(self, args, fixtures):
+        self.args = args
+        self.fixtures = fixtures
+        weights = parse_mix(args.mix, fixtures)
+        self.endpoints = list(weights)
+        self.weights = list(weights.values())
+        self.remaining = args.requests
+        self.deadline = None
+        self.lock = threading.Lock()
+
+    def take_request(self):
+        """whether a client may send another request"""
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            return False
+        if self.remaining is None:
+            return True
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+    def run(self):
+        """runs the clients, returns the samples and the elapsed seconds"""
+        clients = [Client(self, seed) for seed in range(self.args.concurrency)]
+        started_at = time.perf_counter()
+        if self.args.requests is None:
+            self.deadline = started_at + self.args.duration
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = time.perf_counter() - started_at
+        return [sample for client in clients for sample in client.samples], elapsed
+
+
+def summarize(samples, elapsed):
+    """throughput, outcome counts and latency percentiles, overall and per endpoint"""
+    def stats(selected):
+        latencies = sorted(latency for _, outcome, latency in selected if outcome == 'done')
+        outcomes = {}
+        for _, outcome, _ in selected:
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        return {
+            'requests': len(selected),
+            'outcomes': outcomes,
+            'throughput': len(latencies) / elapsed if elapsed else 0.0,
+            'mean': sum(latencies) / len(latencies) if latencies else None,
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else None,
+        }
+
+    endpoints = sorted({endpoint for endpoint, _, _ in samples})
+    return {
+        'elapsed': elapsed,
+        'overall': stats(samples),
+        'endpoints': {endpoint: stats([sample for sample in samples if sample[0] == endpoint])
+                      for endpoint in endpoints},
+    }
+
+
+def print_report(summary):
+    """prints the summary as a table, latencies in milliseconds"""
+    def millis(value):
+        return f'{value * 1000:9.1f}' if value is not None else f'{"-":>9}'
+
+    print(f'{"endpoint":<24}{"requests":>9}{"done/s":>9}{"p50":>9}{"p95":>9}{"p99":>9}'
+          f'{"max":>9}  failures')
+    rows = list(summary['endpoints'].items()) + [('overall', summary['overall'])]
+    for endpoint, stats in rows:
+        failures = {outcome: count for outcome, count in stats['outcomes'].items()
+                    if outcome != 'done'}
+        print(f'{endpoint:<24}{stats["requests"]:>9}{stats["throughput"]:>9.1f}'
+              f'{millis(stats["p50"])}{millis(stats["p95"])}{millis(stats["p99"])}'
+              f'{millis(stats["max"])}  {failures or ""}')
+
+
+def compare(summary, baseline, threshold):
+    """regressions of the summary against a baseline run"""
+    regressions = []
+    rows = [('overall', summary['overall'], baseline['overall'])]
+    rows += [(endpoint, stats, baseline['endpoints'][endpoint])
+             for endpoint, stats in summary['endpoints'].items()
+             if endpoint in baseline['endpoints']]
+    for endpoint, stats, base in rows:
+        for key in ('p50', 'p95', 'p99'):
+            if stats[key] is not None and base[key] and stats[key] > base[key] * (1 + threshold):
+                regressions.append(f'{endpoint} {key}: {base[key] * 1000:.1f}ms -> '
+                                   f'{stats[key] * 1000:.1f}ms')
+        if base['throughput'] and stats['throughput'] < base['throughput'] * (1 - threshold):
+            regressions.append(f'{endpoint} throughput: {base["throughput"]:.1f}/s -> '
+                               f'{stats["throughput"]:.1f}/s')
+    return regressions
+
+
+def parse_args():
+    """command line options"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--tests-dir', default='tests')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to run, unless --requests is given')
+    parser.add_argument('--requests', type=int, help='total number of requests to send')
+    parser.add_argument('--mix', default='',
+                        help='endpoint weights, e.g. best5=3,state_mean=1 (default: uniform)')
+    parser.add_argument('--wait', type=float, default=5,
+                        help='long-poll seconds of get_results, 0 to poll')
+    parser.add_argument('--poll-interval', type=float, default=0.01,
+                        help='seconds between two polls when --wait is 0')
+    parser.add_argument('--timeout', type=float, default=30, help='seconds to wait for a result')
+    parser.add_argument('--output', help='file the results are written to, as JSON')
+    parser.add_argument('--compare', help='results of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative change reported as a regression')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    fixtures = load_fixtures(args.tests_dir)
+    summary = summarize(*Benchmark(args, fixtures).run())
+    summary['run'] = {
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'url': args.url,
+        'concurrency': args.concurrency,
+        'mix': args.mix or 'uniform',
+        'wait': args.wait,
+    }
+    print_report(summary)
+
+    if args.output:
+        with open(args.output, 'w') as fout:
+            json.dump(summary, fout, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as fin:
+            regressions = compare(summary, json.load(fin), args.threshold)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
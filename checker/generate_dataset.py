@@ -0,0 +1,86 @@
+"""Generates a CSV with the schema of the nutrition/activity/obesity dataset
+and any number of rows, by resampling the rows of a source extract: the
+questions, states and stratifications keep their joint frequencies, and the
+values are jittered around the source values of their question.
+
+    python checker/generate_dataset.py --scale 100 --output data_x100.csv
+    python checker/generate_dataset.py --rows 5000000 --output data_5m.csv
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_SOURCE = 'nutrition_activity_obesity_usa_subset.csv'
+# rows generated and written at a time
+CHUNK_ROWS = 500000
+# standard deviation of the jitter, relative to the spread of the question
+JITTER = 0.1
+VALUE_COLUMNS = ['Data_Value', 'Data_Value_Alt']
+
+
+def value_columns(columns):
+    """numeric columns shifted by the jitter of Data_Value"""
+    return [column for column in columns
+            if column.strip() in VALUE_COLUMNS or 'Confidence_Limit' in column]
+
+
+def generate_chunks(source, rows, seed=1, chunk_rows=CHUNK_ROWS):
+    """yields frames of up to `chunk_rows` rows, `rows` in total"""
+    rng = np.random.default_rng(seed)
+    values = pd.to_numeric(source['Data_Value'], errors='coerce')
+    spread = values.groupby(source['Question'], observed=True).transform('std').fillna(0)
+    shifted = value_columns(source.columns)
+    numeric = {column: pd.to_numeric(source[column], errors='coerce').to_numpy()
+               for column in shifted}
+
+    generated = 0
+    while generated < rows:
+        size = min(chunk_rows, rows - generated)
+        picked = rng.integers(0, len(source), size)
+        chunk = source.iloc[picked].reset_index(drop=True)
+        noise = rng.normal(0, 1, size) * JITTER * spread.to_numpy()[picked]
+        for column in shifted:
+            chunk[column] = np.clip(numeric[column][picked] + noise, 0, 100).round(1)
+        generated += size
+        yield chunk
+
+
+def generate(source_path, output_path, rows, seed=1):
+    """writes `rows` generated rows to `output_path`"""
+    source = pd.read_csv(source_path, dtype=str, keep_default_na=False, na_values=[''])
+    if source.empty:
+        sys.exit(f'No rows in {source_path}')
+    header = True
+    for chunk in generate_chunks(source, rows, seed):
+        chunk.to_csv(output_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+
+
+def parse_args():
+    """command line options"""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=DEFAULT_SOURCE, help='extract to resample')
+    parser.add_argument('--output', required=True)
+    size = parser.add_mutually_exclusive_group(required=True)
+    size.add_argument('--rows', type=int, help='number of rows to generate')
+    size.add_argument('--scale', type=float, help='number of rows, in multiples of the source')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rows = args.rows
+    if rows is None:
+        with open(args.source, 'rb') as fin:
+            source_rows = sum(1 for _ in fin) - 1
+        rows = round(source_rows * args.scale)
+    generate(args.source, args.output, rows, args.seed)
+    print(f'Wrote {rows} rows to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
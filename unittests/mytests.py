@@ -1,6 +1,10 @@
 import json
+import math
 import unittest
 import os
+import tempfile
+from app import snapshot
+from app.aggregate_index import AggregateIndex
 from app.data_ingestor import DataIngestor
 
 data_ingestor = DataIngestor("../nutrition_activity_obesity_usa_subset.csv")
@@ -11,6 +15,82 @@ class TestWebserver(unittest.TestCase):
     def test_read_file(self):
         self.assertIsNotNone(data_ingestor.df)
 
+    def test_compact_read(self):
+        self.assertCountEqual(data_ingestor.df.columns,
+                              ['Question', 'LocationDesc', 'StratificationCategory1',
+                               'Stratification1', 'Data_Value'])
+        self.assertEqual(data_ingestor.df['Question'].dtype, 'category')
+        self.assertEqual(data_ingestor.df['Data_Value'].dtype, 'float64')
+
+    def test_snapshot(self):
+        source = {'size': 1, 'mtime_ns': 2, 'sha256': 'abc'}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'data.csv.snapshot')
+            snapshot.write_snapshot(data_ingestor.df, path, source)
+            mapped = snapshot.load_snapshot(path, source)
+            self.assertTrue(mapped.equals(data_ingestor.df))
+            self.assertIsNone(snapshot.load_snapshot(path, dict(source, size=3)))
+
+    def test_aggregate_index(self):
+        with open("../tests/states_mean/input/in-1.json", 'r') as f:
+            question = json.load(f)['question']
+        rows = data_ingestor.df[data_ingestor.df['Question'] == question]
+        expected = rows.groupby('LocationDesc')['Data_Value'].mean().dropna()
+        result = data_ingestor.index.get(question).state_means().dropna()
+        self.assertEqual(result.to_dict(), expected.to_dict())
+        self.assertNotIn("not a question", data_ingestor.index)
+
+    def test_aggregate_index_non_string_state(self):
+        aggregates = next(iter(data_ingestor.index.questions.values()))
+        for state in [{}, ['Ohio'], ('Ohio',), None, 3]:
+            self.assertTrue(math.isnan(aggregates.state_mean(state)))
+            self.assertTrue(aggregates.state_category_means(state).empty)
+
+    def test_batch(self):
+        with open("../tests/state_mean/input/in-1.json", 'r') as f:
+            data = json.load(f)
+        queries = [
+            {'endpoint': 'best5', 'question': data['question']},
+            {'endpoint': 'state_mean', 'question': data['question'], 'state': data['state']},
+            {'endpoint': 'global_mean', 'question': data['question']},
+        ]
+        self.assertEqual(data_ingestor.batch(queries), [
+            data_ingestor.best5(data['question']),
+            data_ingestor.state_mean(data['question'], data['state']),
+            data_ingestor.global_mean(data['question']),
+        ])
+
+    def assert_same_aggregates(self, index, expected_index):
+        self.assertCountEqual(index.questions, expected_index.questions)
+        for question, expected in expected_index.questions.items():
+            aggregates = index.get(question)
+            self.assertAlmostEqual(aggregates.global_mean(), expected.global_mean(), places=9)
+            self.assertEqual(aggregates.total_count, expected.total_count)
+            for means, expected_means in [(aggregates.state_means(), expected.state_means()),
+                                          (aggregates.category_means(), expected.category_means())]:
+                self.assertEqual(len(means.dropna()), len(expected_means.dropna()))
+                for key, value in expected_means.dropna().items():
+                    self.assertAlmostEqual(means[key], value, places=9)
+
+    def test_append_rows(self):
+        half = len(data_ingestor.df) // 2
+        rows = data_ingestor.df.iloc[half:].astype(object).to_dict('records')
+        ingestor = DataIngestor("../nutrition_activity_obesity_usa_subset.csv")
+        ingestor.index = AggregateIndex.from_frame(data_ingestor.df.iloc[:half])
+        appended = ingestor.with_rows(rows)
+        self.assertEqual((ingestor.version, appended.version), (1, 2))
+        self.assertEqual((ingestor.appended_rows, appended.appended_rows), (0, len(rows)))
+        self.assert_same_aggregates(appended.index, data_ingestor.index)
+
+    def test_streamed_read(self):
+        os.environ['DATA_CHUNK_ROWS'] = '1000'
+        try:
+            ingestor = DataIngestor("../nutrition_activity_obesity_usa_subset.csv")
+        finally:
+            del os.environ['DATA_CHUNK_ROWS']
+        self.assertIsNone(ingestor.df)
+        self.assert_same_aggregates(ingestor.index, data_ingestor.index)
+
     def test_states_mean(self):
         for i in range(1, len(os.listdir("../tests/states_mean/input"))):
             with open(f"../tests/states_mean/input/in-{i}.json", 'r') as f:
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+from app import webserver
+from app.async_server import AsyncFrontEnd, parse_head
+
+
+async def request(port, method, target, body=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    content = json.dumps(body).encode() if body is not None else b''
+    writer.write(f'{method} {target} HTTP/1.1\r\nHost: localhost\r\n'
+                 f'Content-Type: application/json\r\nContent-Length: {len(content)}\r\n'
+                 f'Connection: close\r\n\r\n'.encode() + content)
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    return head.split(b' ')[1], json.loads(payload)
+
+
+async def exchange(port, data):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(data)
+    response = await asyncio.wait_for(reader.read(), 5)
+    writer.close()
+    return response
+
+
+class TestAsyncFrontEnd(unittest.TestCase):
+
+    def run_requests(self, *requests):
+        async def run():
+            front_end = AsyncFrontEnd(webserver, webserver.tasks_runner, 5, threads=2)
+            server = await front_end.serve('127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                results = []
+                for method, target, body in requests:
+                    results.append(await request(port, method, target, body))
+                return results
+        return asyncio.run(run())
+
+    def test_long_poll(self):
+        question = next(iter(webserver.data_ingestor.index.questions))
+        (_, submitted), = self.run_requests(('POST', '/api/global_mean', {'question': question}))
+        (code, result), (_, unknown) = self.run_requests(
+            ('GET', f'/api/get_results/{submitted["job_id"]}?wait=5', None),
+            ('GET', '/api/get_results/job_id_0?wait=5', None))
+        self.assertEqual(code, b'200')
+        self.assertEqual(result['status'], 'done')
+        self.assertIn('global_mean', result['data'])
+        self.assertEqual(unknown['reason'], 'Invalid job_id')
+
+    def test_inline_result(self):
+        question = next(iter(webserver.data_ingestor.index.questions))
+        (_, inline), (_, submitted), (_, invalid) = self.run_requests(
+            ('POST', '/api/best5?wait=5', {'question': question}),
+            ('POST', '/api/best5', {'question': question}),
+            ('POST', '/api/best5?wait=5', {}))
+        self.assertEqual(inline['status'], 'done')
+        self.assertEqual(inline['version'], webserver.data_ingestor.version)
+        self.assertIn('job_id', submitted)
+        self.assertEqual(invalid['reason'], 'Missing question parameter')
+
+    def test_batch_endpoint_not_a_string(self):
+        question = next(iter(webserver.data_ingestor.index.questions))
+        (code, listed), (_, mapped) = self.run_requests(
+            ('POST', '/api/batch', {'queries': [{'endpoint': ['best5'], 'question': question}]}),
+            ('POST', '/api/batch', {'queries': [{'endpoint': {}, 'question': question}]}))
+        self.assertEqual(code, b'200')
+        self.assertEqual(listed['reason'], 'Missing or invalid queries parameter')
+        self.assertEqual(mapped['reason'], 'Missing or invalid queries parameter')
+
+    def exchange(self, *data):
+        async def run():
+            front_end = AsyncFrontEnd(webserver, webserver.tasks_runner, 5, threads=2)
+            server = await front_end.serve('127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                return [await exchange(port, request) for request in data]
+        return asyncio.run(run())
+
+    def test_parse_head(self):
+        head = (b'GET /api/jobs HTTP/1.1\r\nAccept: text/html\r\nX-Id: 1\r\n'
+                b'accept: application/json\r\n\r\n')
+        self.assertEqual(parse_head(head), ('GET', '/api/jobs', 'HTTP/1.1', {
+            'ACCEPT': 'text/html,application/json', 'X_ID': '1'}))
+        for head in (b'GET /api/jobs\r\n\r\n', b'GET  /api/jobs HTTP/1.1\r\n\r\n',
+                     b'GET /api/jobs FTP/1.0\r\n\r\n', b'\x16\x03\x01\r\n\r\n',
+                     b'GET /api/jobs HTTP/1.1\r\nno colon\r\n\r\n'):
+            with self.assertRaises(ValueError):
+                parse_head(head)
+
+    def test_malformed_requests(self):
+        responses = self.exchange(
+            b'GET /api/jobs\r\n\r\n',
+            b'POST /api/best5 HTTP/1.1\r\nContent-Length: 2\r\nContent-Length: 3\r\n\r\n{}',
+            b'POST /api/best5 HTTP/1.1\r\nContent-Length: -1\r\n\r\n')
+        for response in responses:
+            self.assertTrue(response.startswith(b'HTTP/1.1 400 Bad Request\r\n'), response)
+
+    def test_body_then_kept_alive_request(self):
+        question = next(iter(webserver.data_ingestor.index.questions))
+        body = json.dumps({'question': question}).encode()
+        response, = self.exchange(
+            b'POST /api/global_mean HTTP/1.1\r\nContent-Type: application/json\r\n'
+            b'Content-Length: %d\r\n\r\n%s' % (len(body), body) +
+            b'GET /api/jobs?limit=1 HTTP/1.1\r\nConnection: close\r\n\r\n')
+        first, second = response.split(b'HTTP/1.1 ')[1:]
+        self.assertTrue(first.startswith(b'200'))
+        self.assertIn(b'Connection: keep-alive', first)
+        self.assertIn(b'"job_id"', first)
+        self.assertTrue(second.startswith(b'200'))
+        self.assertIn(b'"total"', second)
+
+    @mock.patch('app.async_server.KEEP_ALIVE_TIMEOUT', 0.2)
+    @mock.patch('app.async_server.READ_TIMEOUT', 0.2)
+    def test_slow_clients_closed(self):
+        async def run():
+            front_end = AsyncFrontEnd(webserver, webserver.tasks_runner, 5, threads=2)
+            server = await front_end.serve('127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                idle_reader, _ = await asyncio.open_connection('127.0.0.1', port)
+                body_reader, body_writer = await asyncio.open_connection('127.0.0.1', port)
+                body_writer.write(b'POST /api/best5 HTTP/1.1\r\nContent-Length: 10\r\n\r\n{')
+                return await asyncio.wait_for(
+                    asyncio.gather(idle_reader.read(), body_reader.read()), 5)
+        idle, slow_body = asyncio.run(run())
+        self.assertEqual(idle, b'')
+        self.assertTrue(slow_body.startswith(b'HTTP/1.1 408'))
@@ -0,0 +1,87 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+from app.data_ingestor import DataIngestor
+from app.dataset_reloader import DatasetReloader
+
+SOURCE = '../nutrition_activity_obesity_usa_subset.csv'
+
+
+class TestDatasetReloader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'data.csv')
+        with open(SOURCE, 'r') as fin, open(self.path, 'w') as fout:
+            fout.writelines(line for _, line in zip(range(2001), fin))
+        self.swapped = []
+        self.reloader = DatasetReloader(DataIngestor(self.path), self.swapped.append)
+        self.question = next(iter(self.reloader.data_ingestor.index.questions))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def append_rows(self):
+        with open(SOURCE, 'r') as fin, open(self.path, 'a') as fout:
+            fout.writelines(line for i, line in zip(range(4001), fin) if i > 2000)
+
+    def test_reload(self):
+        old = self.reloader.data_ingestor
+        old_query = old.global_mean
+        old_mean = old_query(self.question)
+        self.append_rows()
+        self.assertTrue(self.reloader.reload())
+        new = self.reloader.data_ingestor
+        self.assertEqual(self.swapped, [new])
+        self.assertEqual((old.version, new.version), (1, 2))
+        self.assertNotEqual(new.global_mean(self.question), old_mean)
+        # a job bound to the old ingestor still answers from the old version
+        self.assertEqual(old_query(self.question), old_mean)
+
+    def test_append(self):
+        old = self.reloader.data_ingestor
+        old_mean = old.global_mean(self.question)
+        row = {'Question': self.question, 'LocationDesc': 'Ohio',
+               'StratificationCategory1': 'Total', 'Stratification1': 'Total',
+               'Data_Value': 1000.0}
+        self.assertEqual(self.reloader.append([row]), 2)
+        new = self.reloader.data_ingestor
+        self.assertEqual(self.swapped, [new])
+        self.assertGreater(new.global_mean(self.question)['global_mean'],
+                           old_mean['global_mean'])
+        # jobs submitted on the old version keep answering from it
+        self.assertEqual((old.version, old.global_mean(self.question)), (1, old_mean))
+
+    def test_append_during_reload(self):
+        row = {'Question': self.question, 'LocationDesc': 'Ohio',
+               'StratificationCategory1': 'Total', 'Stratification1': 'Total',
+               'Data_Value': 1000.0}
+
+        def load(*args):
+            reloaded = DataIngestor(*args)
+            # an append lands while the csv is loaded
+            self.assertEqual(self.reloader.append([row]), 2)
+            return reloaded
+
+        with mock.patch('app.dataset_reloader.DataIngestor', side_effect=load):
+            self.assertTrue(self.reloader.reload())
+        self.assertEqual(self.reloader.data_ingestor.version, 3)
+        self.assertEqual(self.reloader.data_ingestor.appended_rows, 0)
+
+    def test_failed_reload_keeps_version(self):
+        os.remove(self.path)
+        self.assertTrue(self.reloader.reload())
+        self.assertEqual(self.reloader.data_ingestor.version, 1)
+        self.assertEqual(self.swapped, [])
+        self.assertIsNotNone(self.reloader.status()['last_error'])
+
+    def test_watch(self):
+        self.reloader.watch(0.05)
+        time.sleep(0.1)
+        self.append_rows()
+        deadline = time.monotonic() + 5
+        while self.reloader.data_ingestor.version == 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.reloader.data_ingestor.version, 2)
@@ -0,0 +1,56 @@
+import time
+import unittest
+from queue import Empty
+from app.job_queue import JobQueue, QueueFullError
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def test_clients_served_in_turn(self):
+        queue = JobQueue()
+        for item in ['a1', 'a2', 'a3']:
+            queue.put(item, 'a')
+        queue.put('b1', 'b')
+        queue.put('c1', 'c')
+        self.assertEqual([queue.get(timeout=0) for _ in range(5)],
+                         ['a1', 'b1', 'c1', 'a2', 'a3'])
+        self.assertRaises(Empty, queue.get, timeout=0)
+
+    def test_max_depth(self):
+        queue = JobQueue(max_depth=2)
+        queue.put(1, 'a')
+        queue.put(2, 'b')
+        self.assertRaises(QueueFullError, queue.put, 3, 'c')
+        self.assertEqual(queue.stats()['rejected']['queue_full'], 1)
+
+    def test_max_client_depth(self):
+        queue = JobQueue(max_client_depth=1)
+        queue.put(1, 'a')
+        self.assertRaises(QueueFullError, queue.put, 2, 'a')
+        queue.put(3, 'b')
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(queue.stats()['rejected']['client_limit'], 1)
+
+    def test_join(self):
+        queue = JobQueue()
+        queue.put(1)
+        queue.get()
+        queue.task_done()
+        queue.join()
+        self.assertTrue(queue.empty())
+
+    def test_priority_classes(self):
+        queue = JobQueue(aging=0)
+        queue.put('low', 'a', 'low')
+        queue.put('normal', 'a', 'normal')
+        queue.put('high', 'b', 'high')
+        self.assertEqual([queue.get(timeout=0) for _ in range(3)], ['high', 'normal', 'low'])
+        self.assertEqual(queue.stats()['classes']['high']['served'], 1)
+
+    def test_aging(self):
+        queue = JobQueue(aging=0.01)
+        queue.put('low', 'a', 'low')
+        time.sleep(0.05)
+        queue.put('high', 'b', 'high')
+        self.assertEqual(queue.get(timeout=0), 'low')
+        self.assertGreaterEqual(queue.stats()['classes']['low']['max_wait'], 0.05)
@@ -0,0 +1,80 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from app.job_registry import JobRegistry, MemoryJobRegistry
+
+
+class TestJobRegistry(unittest.TestCase):
+
+    def test_interface(self):
+        self.assertRaises(TypeError, JobRegistry)
+
+    def test_unique_job_ids(self):
+        registry = MemoryJobRegistry()
+        with ThreadPoolExecutor(8) as executor:
+            job_ids = list(executor.map(lambda _: registry.next_job_id(), range(1000)))
+        self.assertEqual(len(set(job_ids)), 1000)
+        self.assertEqual(registry.next_job_id(), 'job_id_1001')
+
+    def test_transitions(self):
+        registry = MemoryJobRegistry()
+        registry.queued('job_id_1', 'best5')
+        self.assertEqual(registry.get('job_id_1').status, 'queued')
+        registry.running('job_id_1')
+        registry.failed('job_id_1', 'OS error')
+        record = registry.get('job_id_1')
+        self.assertEqual((record.status, record.reason), ('error', 'OS error'))
+        self.assertLessEqual(record.submitted_at, record.started_at)
+        self.assertLessEqual(record.started_at, record.finished_at)
+        self.assertIsNone(registry.get('job_id_2'))
+
+    def test_pages(self):
+        registry = MemoryJobRegistry()
+        for number in range(1, 6):
+            registry.queued(f'job_id_{number}', 'best5')
+        registry.done('job_id_4')
+        registry.done('job_id_2')
+        total, page = registry.list_jobs(after=1, limit=2)
+        self.assertEqual(total, 5)
+        self.assertEqual([record.job_id for record in page], ['job_id_2', 'job_id_3'])
+        total, page = registry.list_jobs('done')
+        self.assertEqual(total, 2)
+        self.assertEqual([record.job_id for record in page], ['job_id_2', 'job_id_4'])
+        _, page = registry.list_jobs('queued', limit=2)
+        self.assertEqual([record.job_id for record in page], ['job_id_1', 'job_id_3'])
+        # the cursor stays valid once its job left the listed state
+        registry.running('job_id_3')
+        _, page = registry.list_jobs('queued', after=page[-1].seq)
+        self.assertEqual([record.job_id for record in page], ['job_id_5'])
+        self.assertEqual(registry.counts(), {'queued': 2, 'running': 1, 'done': 2, 'error': 0})
+
+    def test_max_jobs(self):
+        registry = MemoryJobRegistry(max_jobs=2)
+        for number in range(1, 4):
+            registry.queued(f'job_id_{number}', 'best5')
+        self.assertIsNone(registry.get('job_id_1'))
+        self.assertEqual(registry.list_jobs('queued')[0], 2)
+        _, page = registry.list_jobs(after=2)
+        self.assertEqual([record.job_id for record in page], ['job_id_3'])
+        _, page = registry.list_jobs(after=0, limit=1)
+        self.assertEqual([record.job_id for record in page], ['job_id_2'])
+
+    def test_pages_in_submission_order(self):
+        registry = MemoryJobRegistry(max_jobs=50)
+        for number in range(1, 201):
+            registry.queued(f'job_id_{number}', 'best5')
+            if number % 3 == 0:
+                registry.running(f'job_id_{number - 1}')
+            if number % 5 == 0:
+                registry.done(f'job_id_{number - 2}')
+        for status in (None, 'queued', 'running', 'done'):
+            expected = [record.job_id for record in
+                        (registry.get(f'job_id_{number}') for number in range(151, 201))
+                        if status is None or record.status == status]
+            listed, after = [], 0
+            while True:
+                _, page = registry.list_jobs(status, after, limit=7)
+                listed += [record.job_id for record in page]
+                if len(page) < 7:
+                    break
+                after = page[-1].seq
+            self.assertEqual(listed, expected)
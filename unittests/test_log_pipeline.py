@@ -0,0 +1,33 @@
+import logging
+import queue
+import unittest
+from app.log_pipeline import DroppingQueueHandler, SamplingFilter, parse_logger_settings
+
+
+def make_record(level, msg='job %s', args=('job_id_1',)):
+    return logging.LogRecord('webserver', level, __file__, 1, msg, args, None)
+
+
+class TestLogPipeline(unittest.TestCase):
+
+    def test_queue_handler_never_blocks(self):
+        handler = DroppingQueueHandler(queue.Queue(1))
+        record = make_record(logging.INFO)
+        handler.handle(record)
+        handler.handle(make_record(logging.INFO))
+        self.assertEqual(handler.dropped, 1)
+        queued = handler.queue.get_nowait()
+        # queued unformatted, the listener builds the message
+        self.assertIs(queued, record)
+        self.assertEqual(queued.args, ('job_id_1',))
+
+    def test_sampling(self):
+        sampling = SamplingFilter(0.25)
+        kept = [sampling.filter(make_record(logging.INFO)) for _ in range(100)]
+        self.assertEqual(sum(kept), 25)
+        self.assertTrue(sampling.filter(make_record(logging.ERROR)))
+
+    def test_logger_settings(self):
+        self.assertEqual(parse_logger_settings('werkzeug=WARNING, webserver=INFO'),
+                         {'werkzeug': 'WARNING', 'webserver': 'INFO'})
+        self.assertEqual(parse_logger_settings(''), {})
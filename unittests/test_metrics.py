@@ -0,0 +1,54 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from app.job_registry import MemoryJobRegistry
+from app.metrics import Metrics, store_samples
+from app.result_cache import ResultCache
+from app.result_store import MemoryResultStore
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counters_summed_over_threads(self):
+        metrics = Metrics()
+
+        def record(_):
+            for _ in range(1000):
+                metrics.inc('requests_total', (('endpoint', 'best5'),))
+
+        with ThreadPoolExecutor(4) as executor:
+            list(executor.map(record, range(8)))
+        self.assertEqual(metrics.collect()[('requests_total', (('endpoint', 'best5'),))], 8000)
+
+    def test_shards_of_exited_threads_retired(self):
+        metrics = Metrics()
+        for _ in range(300):
+            thread = threading.Thread(target=metrics.inc, args=('requests_total',))
+            thread.start()
+            thread.join()
+        self.assertLessEqual(metrics.shard_count(), 1)
+        self.assertEqual(metrics.collect()[('requests_total', ())], 300)
+
+    def test_histogram(self):
+        metrics = Metrics(buckets=(0.1, 1.0))
+        labels = (('method', 'best5'),)
+        for value in [0.05, 0.1, 0.5, 2.0]:
+            metrics.observe('webserver_job_execution_seconds', labels, value)
+        text = metrics.render([('webserver_uptime_seconds', (), 3)])
+        self.assertIn('# TYPE webserver_job_execution_seconds histogram', text)
+        self.assertIn('webserver_job_execution_seconds_bucket{method="best5",le="0.1"} 2', text)
+        self.assertIn('webserver_job_execution_seconds_bucket{method="best5",le="1.0"} 3', text)
+        self.assertIn('webserver_job_execution_seconds_bucket{method="best5",le="+Inf"} 4', text)
+        self.assertIn('webserver_job_execution_seconds_count{method="best5"} 4', text)
+        self.assertIn('webserver_uptime_seconds 3', text)
+
+    def test_store_samples(self):
+        registry = MemoryJobRegistry()
+        registry.queued('job_id_1', 'best5')
+        registry.done('job_id_1')
+        store = MemoryResultStore()
+        store.put('job_id_1', b'{}')
+        samples = store_samples(registry, store, ResultCache())
+        self.assertIn(('webserver_jobs', (('state', 'done'),), 1), samples)
+        self.assertIn(('webserver_result_store_entries', (), 1), samples)
+        self.assertIn(('webserver_result_cache_hit_ratio', (), 0.0), samples)
@@ -0,0 +1,37 @@
+import marshal
+import unittest
+from app.profiling import Profiler
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_sampling(self):
+        profiler = Profiler(('jobs',), sample_rate=1)
+        for _ in range(3):
+            with profiler.profile('jobs', 'fib'):
+                fib(15)
+        with profiler.profile('requests', 'index'):
+            fib(5)
+        self.assertEqual(profiler.summary()['runs'], {'fib': 3})
+        profiler.configure(['jobs'], 0)
+        with profiler.profile('jobs', 'fib'):
+            fib(5)
+        self.assertEqual(profiler.summary()['runs'], {'fib': 3})
+        self.assertRaises(ValueError, profiler.configure, ['disk'], 0.5)
+
+    def test_exports(self):
+        profiler = Profiler(('jobs',), sample_rate=1)
+        with profiler.profile('jobs', 'fib'):
+            fib(15)
+        stats = marshal.loads(profiler.pstats_bytes('fib'))
+        fib_calls = [entry[1] for (_, _, name), entry in stats.items() if name == 'fib']
+        self.assertEqual(fib_calls, [1973])
+        stacks = dict(line.rsplit(' ', 1) for line in profiler.collapsed('fib').splitlines())
+        fib_stacks = [stack for stack in stacks if stack.startswith('fib (test_profiling.py')]
+        self.assertEqual(len(fib_stacks), 1)
+        self.assertGreater(int(stacks[fib_stacks[0]]), 0)
+        self.assertIsNone(profiler.pstats_bytes('best5'))
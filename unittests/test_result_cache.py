@@ -0,0 +1,65 @@
+import unittest
+from app.result_cache import ResultCache, query_key
+from app.result_store import encode_result
+
+
+class FakeIngestor:
+    def __init__(self):
+        self.version = 1
+        self.calls = 0
+
+    def states_mean(self, question):
+        self.calls += 1
+        return {question: self.calls}
+
+
+def cached_call(cache, task_func, *args):
+    return cache.get_or_compute(query_key(task_func, args, {}), task_func.__self__.version,
+                                lambda: encode_result(task_func(*args)))
+
+
+class TestResultCache(unittest.TestCase):
+
+    def test_hit_and_miss(self):
+        cache = ResultCache()
+        ingestor = FakeIngestor()
+        self.assertEqual(cached_call(cache, ingestor.states_mean, 'q'), b'{"q": 1}')
+        self.assertEqual(cached_call(cache, ingestor.states_mean, 'q'), b'{"q": 1}')
+        self.assertEqual(ingestor.calls, 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_version_invalidation(self):
+        cache = ResultCache()
+        ingestor = FakeIngestor()
+        cached_call(cache, ingestor.states_mean, 'q')
+        ingestor.version = 2
+        self.assertEqual(cached_call(cache, ingestor.states_mean, 'q'), b'{"q": 2}')
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+    def test_older_version_missed(self):
+        cache = ResultCache()
+        cache.get(('a',), 2)
+        cache.put(('a',), 2, b'a')
+        self.assertEqual(cache.get(('a',), 1), (False, None))
+        cache.put(('a',), 1, b'old')
+        self.assertEqual(cache.get(('a',), 2), (True, b'a'))
+        self.assertEqual(cache.stats()['invalidations'], 0)
+
+    def test_lru_eviction(self):
+        cache = ResultCache(max_entries=2)
+        for key in ['a', 'b', 'a', 'c']:
+            found, _ = cache.get((key,), 1)
+            if not found:
+                cache.put((key,), 1, key.encode())
+        self.assertEqual(cache.get(('b',), 1), (False, None))
+        self.assertEqual(cache.get(('a',), 1), (True, b'a'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_byte_bound(self):
+        cache = ResultCache(max_bytes=20)
+        cache.get(('a',), 1)
+        cache.put(('a',), 1, b'x' * 12)
+        cache.put(('b',), 1, b'y' * 12)
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertLessEqual(cache.stats()['bytes'], 20)
@@ -0,0 +1,57 @@
+import tempfile
+import time
+import unittest
+from app.result_store import (STREAM_CHUNK_BYTES, DiskResultStore, MemoryResultStore,
+                              ResultStore)
+
+
+class TestMemoryResultStore(unittest.TestCase):
+
+    def test_interface(self):
+        self.assertRaises(TypeError, ResultStore)
+
+    def test_put_get(self):
+        store = MemoryResultStore()
+        store.put('job_id_1', b'{"a": 1.5}')
+        self.assertIn('job_id_1', store)
+        self.assertEqual(store.get('job_id_1'), b'{"a": 1.5}')
+        self.assertIsNone(store.get('job_id_2'))
+        self.assertEqual(store.job_ids(), ['job_id_1'])
+
+    def test_ttl(self):
+        store = MemoryResultStore(ttl=0.01)
+        store.put('job_id_1', b'{"a": 1}')
+        time.sleep(0.02)
+        self.assertNotIn('job_id_1', store)
+
+    def test_memory_bound_spills_to_disk(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = MemoryResultStore(max_bytes=30, spill=DiskResultStore(tmp_dir))
+            store.put('job_id_1', b'x' * 20)
+            store.put('job_id_2', b'y' * 20)
+            self.assertLessEqual(store.size_bytes, 30)
+            self.assertEqual(DiskResultStore(tmp_dir).job_ids(), ['job_id_1'])
+            self.assertEqual(store.get('job_id_1'), b'x' * 20)
+            self.assertEqual(store.get('job_id_2'), b'y' * 20)
+
+    def test_memory_bound_without_spill(self):
+        store = MemoryResultStore(max_bytes=30)
+        store.put('job_id_1', b'x' * 20)
+        store.put('job_id_2', b'y' * 20)
+        self.assertIsNone(store.get('job_id_1'))
+        self.assertEqual(store.get('job_id_2'), b'y' * 20)
+
+    def test_open_streams_spilled_results(self):
+        payload = b'z' * (2 * STREAM_CHUNK_BYTES + 1)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = MemoryResultStore(spill=DiskResultStore(tmp_dir), spill_min_bytes=100)
+            store.put('job_id_1', payload)
+            store.put('job_id_2', b'{"a": 1}')
+            size, chunks = store.open('job_id_1')
+            chunks = list(chunks)
+            self.assertEqual(size, len(payload))
+            self.assertEqual(len(chunks), 3)
+            self.assertEqual(b''.join(chunks), payload)
+            size, chunks = store.open('job_id_2')
+            self.assertEqual((size, list(chunks)), (8, [b'{"a": 1}']))
+            self.assertIsNone(store.open('job_id_3'))
@@ -0,0 +1,77 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from app.shared_store import JobDatabase, SharedJobRegistry, SharedResultStore
+
+
+def allocate_job_ids(path, count):
+    registry = SharedJobRegistry(JobDatabase(path))
+    return [registry.next_job_id() for _ in range(count)]
+
+
+# registry inherited by the forked processes
+INHERITED = {}
+
+
+def allocate_inherited_job_ids(count):
+    registry = INHERITED['registry']
+    return [registry.next_job_id() for _ in range(count)]
+
+
+class TestSharedStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'jobs.db')
+        self.database = JobDatabase(self.path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_job_ids_unique_across_processes(self):
+        with ProcessPoolExecutor(4) as executor:
+            batches = list(executor.map(allocate_job_ids, [self.path] * 4, [50] * 4))
+        job_ids = [job_id for batch in batches for job_id in batch]
+        self.assertEqual(len(set(job_ids)), 200)
+
+    def test_connections_not_shared_after_fork(self):
+        INHERITED['registry'] = SharedJobRegistry(self.database)
+        parent_connection = self.database.connection()
+        first = INHERITED['registry'].next_job_id()
+        with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context('fork')) as executor:
+            batches = list(executor.map(allocate_inherited_job_ids, [50] * 2))
+        job_ids = [first] + [job_id for batch in batches for job_id in batch]
+        self.assertEqual(len(set(job_ids)), 101)
+        self.assertIs(self.database.connection(), parent_connection)
+        self.assertEqual(INHERITED['registry'].next_job_id(), 'job_id_102')
+
+    def test_registry(self):
+        registry = SharedJobRegistry(self.database, max_jobs=3)
+        for number in range(1, 5):
+            registry.queued(f'job_id_{number}', 'best5')
+        registry.running('job_id_3')
+        registry.failed('job_id_3', 'OS error')
+        # another process opening the same database sees the same jobs
+        other = SharedJobRegistry(JobDatabase(self.path))
+        self.assertIsNone(other.get('job_id_1'))
+        record = other.get('job_id_3')
+        self.assertEqual((record.status, record.reason), ('error', 'OS error'))
+        total, page = other.list_jobs('queued', limit=1)
+        self.assertEqual((total, [record.job_id for record in page]), (2, ['job_id_2']))
+        _, page = other.list_jobs('queued', after=page[-1].seq)
+        self.assertEqual([record.job_id for record in page], ['job_id_4'])
+        # the cursor stays valid once its job left the listed state
+        _, page = other.list_jobs('queued', after=record.seq)
+        self.assertEqual([record.job_id for record in page], ['job_id_4'])
+        self.assertEqual(other.counts(), {'queued': 2, 'running': 0, 'done': 0, 'error': 1})
+
+    def test_result_store(self):
+        store = SharedResultStore(self.database)
+        store.put('job_id_1', b'{"a": 1}')
+        other = SharedResultStore(JobDatabase(self.path))
+        self.assertIn('job_id_1', other)
+        self.assertEqual(other.get('job_id_1'), b'{"a": 1}')
+        self.assertIsNone(other.get('job_id_2'))
+        self.assertEqual(other.job_ids(), ['job_id_1'])
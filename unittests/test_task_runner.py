@@ -0,0 +1,141 @@
+import asyncio
+import os
+import time
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+from app.job_queue import QueueFullError
+from app.process_backend import ProcessBackend
+from app.result_store import MemoryResultStore
+from app.task_runner import ThreadPool
+
+
+def failing_task():
+    raise RuntimeError('boom')
+
+
+def slow_task(seconds):
+    time.sleep(seconds)
+    return {'slept': seconds}
+
+
+class FakeIngestor:
+    version = 1
+
+    def __init__(self):
+        self.calls = 0
+        self.df = None
+
+    def global_mean(self, question):
+        self.calls += 1
+        time.sleep(0.1)
+        return {'global_mean': len(question)}
+
+    def failing_mean(self, question):
+        raise RuntimeError(question)
+
+    def exit_worker(self, code):
+        os._exit(code)
+
+
+class TestProcessBackend(unittest.TestCase):
+
+    def test_run_in_worker(self):
+        ingestor = FakeIngestor()
+        backend = ProcessBackend(ingestor, 1)
+        try:
+            self.assertTrue(backend.accepts(ingestor.global_mean, {}))
+            self.assertFalse(backend.accepts(slow_task, {}))
+            self.assertEqual(backend.run(ingestor.global_mean, ('abc',)),
+                             b'{"global_mean": 3}')
+        finally:
+            backend.shutdown()
+
+    def test_dead_worker(self):
+        ingestor = FakeIngestor()
+        backend = ProcessBackend(ingestor, 1)
+        try:
+            with self.assertRaises(BrokenProcessPool):
+                backend.run(ingestor.exit_worker, (1,))
+            self.assertEqual(backend.run(ingestor.global_mean, ('abc',)),
+                             b'{"global_mean": 3}')
+        finally:
+            backend.shutdown()
+
+
+class TestThreadPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ThreadPool(result_store=MemoryResultStore())
+
+    def tearDown(self):
+        self.pool.graceful_shutdown()
+
+    def test_wait_for_job(self):
+        self.pool.add_task('job_id_1', slow_task, 0.2)
+        self.assertFalse(self.pool.wait_for_job('job_id_1', 0.01))
+        self.assertTrue(self.pool.wait_for_job('job_id_1', 5))
+        self.assertEqual(self.pool.get_job_result('job_id_1'), b'{"slept": 0.2}')
+
+    def test_wait_for_finished_job(self):
+        self.pool.add_task('job_id_1', slow_task, 0)
+        self.pool.job_queue.join()
+        self.assertTrue(self.pool.wait_for_job('job_id_1', 5))
+
+    def test_job_done(self):
+        self.pool.add_task('job_id_1', slow_task, 0.2)
+        self.assertFalse(asyncio.run(self.pool.job_done('job_id_1', 0.01)))
+        self.assertTrue(asyncio.run(self.pool.job_done('job_id_1', 5)))
+        self.assertTrue(asyncio.run(self.pool.job_done('job_id_1', 5)))
+        self.assertFalse(asyncio.run(self.pool.job_done('job_id_2', 5)))
+
+    def test_coalescing(self):
+        ingestor = FakeIngestor()
+        for job_id in ['job_id_1', 'job_id_2', 'job_id_3']:
+            self.pool.add_task(job_id, ingestor.global_mean, 'abc')
+        for job_id in ['job_id_1', 'job_id_2', 'job_id_3']:
+            self.assertTrue(self.pool.wait_for_job(job_id, 5))
+            self.assertEqual(self.pool.get_job_result(job_id), b'{"global_mean": 3}')
+        self.assertEqual(ingestor.calls, 1)
+        self.assertEqual(self.pool.inflight.coalesced_jobs, 2)
+
+    def test_rejected_job(self):
+        with mock.patch.object(self.pool.job_queue, 'put',
+                               side_effect=QueueFullError('queue_full')):
+            with self.assertRaises(QueueFullError):
+                self.pool.add_task('job_id_1', slow_task, 0)
+        self.assertIsNone(self.pool.job_registry.get('job_id_1'))
+        self.assertEqual(self.pool.job_registry.counts()['error'], 0)
+
+    def test_runners_survive_any_error(self):
+        for runner in range(len(self.pool.runners) + 1):
+            self.pool.add_task(f'job_id_{runner}', failing_task)
+        self.pool.job_queue.join()
+        self.assertTrue(all(runner.is_alive() for runner in self.pool.runners))
+        self.assertEqual(self.pool.job_registry.get('job_id_0').reason, 'RuntimeError: boom')
+        self.pool.add_task('job_id_last', slow_task, 0)
+        self.assertTrue(self.pool.wait_for_job('job_id_last', 5))
+        self.assertEqual(self.pool.job_status('job_id_last'), 'done')
+
+    def test_run_inline(self):
+        ingestor = FakeIngestor()
+        self.assertIsNone(self.pool.run_inline(slow_task, 0))
+        # cost not known yet, then measured by the job
+        self.assertIsNone(self.pool.run_inline(ingestor.global_mean, 'abc'))
+        self.pool.add_task('job_id_1', ingestor.global_mean, 'abc')
+        self.assertTrue(self.pool.wait_for_job('job_id_1', 5))
+        self.assertGreater(self.pool.costs['global_mean'], 0.05)
+        self.assertIsNone(self.pool.run_inline(ingestor.global_mean, 'abcd'))
+        self.pool.costs['global_mean'] = 0
+        self.assertEqual(self.pool.run_inline(ingestor.global_mean, 'abcd'), b'{"global_mean": 4}')
+        self.assertEqual(ingestor.calls, 2)
+        self.pool.costs['failing_mean'] = 0
+        self.assertIsNone(self.pool.run_inline(ingestor.failing_mean, 'abcd'))
+
+    def test_failed_job(self):
+        self.pool.add_task('job_id_1', int, 'abc')
+        self.assertTrue(self.pool.wait_for_job('job_id_1', 5))
+        record = self.pool.job_registry.get('job_id_1')
+        self.assertEqual(record.status, 'error')
+        self.assertTrue(record.reason.startswith('ValueError'))
+        self.assertIsNone(self.pool.get_job_result('job_id_1'))